@@ -0,0 +1,195 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import space_kokatonder as sk
+
+# --set で変えられる調整値
+TUNABLES = (
+    "MID_BOSS_SPAWN_SCORE",
+    "ENEMY_COLLISION_DAMAGE",
+    "ENEMY_BULLET_DAMAGE",
+    "IWA_DAMAGE",
+    "SPAWN_RATE_DECAY",
+    "MIN_SPAWN_RATE",
+    "MID_BOSS_HEALTH",
+    "BIG_ENEMY_HEALTH",
+)
+
+# 自機を動かす入力 (ゲームとシードを受け取って get_pressed(frame) を持つものを返す)
+POLICIES = {
+    "autopilot": lambda game, seed: sk.Autopilot(game),
+    "random": lambda game, seed: sk.RandomInput(seed),
+    "sweep": lambda game, seed: sk.SweepInput(),
+}
+
+parser = argparse.ArgumentParser(description="ヘッドレスのゲームを並列にたくさん走らせてバランスを集計する")
+parser.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2,...", help="調整値と試す値 (複数指定するとすべての組み合わせを試す)")
+parser.add_argument("--runs", type=int, default=100, help="組み合わせごとのプレイ回数 (シードを変えて走らせる)")
+parser.add_argument("--seed", type=int, default=0, help="最初のシード")
+parser.add_argument("--policy", choices=sorted(POLICIES), default="random", help="自機の入力")
+parser.add_argument("--max-frames", type=int, default=sk.FPS * 300, help="1 プレイの最大フレーム数")
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="プロセス数 (1 なら並列にしない)")
+parser.add_argument("--csv", default=None, help="1 プレイごとの結果を書き出す CSV")
+
+# 各プロセスで 1 回だけ作るゲームと、調整値の元の値
+game = None
+defaults = {}
+
+
+def init_worker():
+    global game
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = sk.Game(sk.parser.parse_args(["--headless"]))
+        game.setup()
+    defaults.update({name: getattr(sk, name) for name in TUNABLES})
+
+
+def run_game(job):
+    params, seed, policy, max_frames = job
+    if game is None:
+        init_worker()
+    for name in TUNABLES:
+        setattr(sk, name, params.get(name, defaults[name]))
+    sk.rng.reseed(seed)
+    game.args.frames = max_frames
+    game.scripted_input = POLICIES[policy](game, seed)
+    # パワーアップや勝利のメッセージは捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        game.reset()
+        while game.running:
+            game.step()
+    result = game.result()
+    samples = getattr(game.scripted_input, "samples", None)
+    if samples:
+        result["input_us"] = sum(samples) / len(samples) * 1e6
+    return params, seed, result
+
+
+def parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_sweep(specs):
+    names, values = [], []
+    for spec in specs:
+        name, _, text = spec.partition("=")
+        name = name.strip().upper()
+        if name not in TUNABLES:
+            raise SystemExit(f"Unknown tunable {name!r} (choose from {', '.join(TUNABLES)})")
+        names.append(name)
+        values.append([parse_value(v) for v in text.split(",") if v])
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def median_or_none(values):
+    return statistics.median(values) if values else None
+
+
+def summarize(params, results):
+    n = len(results)
+    survival = [r["survival_ms"] / 1000 for r in results]
+    mid_boss = [r["mid_boss_ms"] / 1000 for r in results if r["mid_boss_ms"] is not None]
+    boss = [r["boss_ms"] / 1000 for r in results if r["boss_ms"] is not None]
+    causes = Counter(r["death_cause"] for r in results if r["death_cause"] is not None)
+    row = {
+        **params,
+        "runs": n,
+        "survival_s": statistics.fmean(survival),
+        "survival_p10": sorted(survival)[n // 10],
+        "score": statistics.fmean(r["score"] for r in results),
+    }
+    for source in sk.DAMAGE_SOURCES:
+        row[f"dmg_{source}"] = statistics.fmean(r["damage"][source] for r in results)
+    row.update({
+        "mid_boss_%": 100 * len(mid_boss) / n,
+        "mid_boss_s": median_or_none(mid_boss),
+        "mid_boss_kill_%": 100 * sum(r["mid_boss_defeated"] for r in results) / n,
+        "boss_%": 100 * len(boss) / n,
+        "boss_s": median_or_none(boss),
+        "win_%": 100 * sum(r["won"] for r in results) / n,
+        "top_death": causes.most_common(1)[0][0] if causes else "-",
+    })
+    # 自動操縦の判断にかかった時間 (1 フレームあたりの平均)
+    costs = [r["input_us"] for r in results if "input_us" in r]
+    if costs:
+        row["input_us"] = statistics.fmean(costs)
+    return row
+
+
+def format_cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def print_table(rows):
+    columns = list(rows[0])
+    cells = [[format_cell(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[i]) for line in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(v.rjust(w) for v, w in zip(line, widths)))
+
+
+def write_csv(path, runs):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        names = sorted({name for params, _, _ in runs for name in params})
+        fields = [k for k in runs[0][2] if k != "damage"]
+        writer.writerow([*names, "seed", *fields, *(f"dmg_{s}" for s in sk.DAMAGE_SOURCES)])
+        for params, seed, result in runs:
+            writer.writerow([
+                *(params.get(name, "") for name in names), seed,
+                *(result[k] for k in fields), *(result["damage"][s] for s in sk.DAMAGE_SOURCES),
+            ])
+    print(f"Per-run results written to {path}")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    combos = parse_sweep(args.set)
+    jobs = [
+        (params, args.seed + i, args.policy, args.max_frames)
+        for params in combos
+        for i in range(args.runs)
+    ]
+    start = time.perf_counter()
+    if args.workers <= 1:
+        runs = [run_game(job) for job in jobs]
+    else:
+        # 1 回のプレイは数十ミリ秒で終わるので、ある程度まとめて各プロセスへ渡す
+        chunksize = max(1, len(jobs) // (args.workers * 8))
+        with ProcessPoolExecutor(args.workers, initializer=init_worker) as pool:
+            runs = list(pool.map(run_game, jobs, chunksize=chunksize))
+    wall = time.perf_counter() - start
+    frames = sum(result["frames"] for _, _, result in runs)
+    print(
+        f"Ran {len(runs)} games ({frames} frames) on {max(1, args.workers)} workers"
+        f" in {wall:.1f} s: {len(runs) / max(wall, 1e-9):.1f} games/s"
+    )
+
+    grouped = {}
+    for params, _, result in runs:
+        grouped.setdefault(tuple(params.items()), []).append(result)
+    print_table([summarize(dict(key), results) for key, results in grouped.items()])
+    if args.csv:
+        write_csv(args.csv, runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
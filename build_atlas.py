@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+import pygame as pg
+
+import space_kokatonder as sk
+
+# アトラスの最小の幅と、画像どうしの間に空ける隙間
+ATLAS_MIN_WIDTH = 256
+PADDING = 1
+
+
+# 背の高い順に、今いちばん低い場所へ左から置いていく (スカイライン法)
+def pack(sizes, width, padding=PADDING):
+    skyline = [0] * width
+    positions = {}
+    for key, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], -item[1][0], str(item[0]))):
+        best = None
+        for x in range(width - w + 1):
+            y = max(skyline[x:x + w])
+            if best is None or y < best[1]:
+                best = (x, y)
+        x, y = best
+        for i in range(x, min(width, x + w + padding)):
+            skyline[i] = y + h + padding
+        positions[key] = (x, y)
+    return positions, max(skyline)
+
+
+def main():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pg.display.init()
+    pg.display.set_mode((1, 1))
+
+    frames = sk.find_explosion_frames()
+    entries = dict(sk.SPRITE_SIZES)
+    for name in frames:
+        entries[name] = [None, *sk.EXPLOSION_SIZES.values()]
+
+    images = {}
+    sources = []
+    for name, sizes in entries.items():
+        path = os.path.join(sk.fig_dir, name)
+        if not os.path.exists(path):
+            print(f"Skipping missing {name}")
+            continue
+        original = pg.image.load(path).convert_alpha()
+        sources.append(name)
+        for size in sizes:
+            images[(name, size)] = original if size is None else pg.transform.scale(original, size)
+
+    width = max(ATLAS_MIN_WIDTH, *(image.get_width() for image in images.values()))
+    positions, height = pack({key: image.get_size() for key, image in images.items()}, width)
+
+    atlas = pg.Surface((width, height), pg.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    sprites = []
+    for key, (x, y) in positions.items():
+        image = images[key]
+        # 透明な面に足し合わせることで、画素 (アルファ込み) をそのまま写す
+        atlas.blit(image, (x, y), special_flags=pg.BLEND_RGBA_ADD)
+        sprites.append([key[0], key[1], [x, y, *image.get_size()]])
+    pg.image.save(atlas, sk.ATLAS_IMAGE)
+
+    with open(sk.ATLAS_INDEX, "w", encoding="utf-8") as f:
+        json.dump({"sources": sources, "explosion_frames": frames, "sprites": sprites}, f, indent=1)
+    print(f"Packed {len(sprites)} sprites from {len(sources)} files into {sk.ATLAS_IMAGE} ({width}x{height})")
+    pg.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
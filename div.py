@@ -29,16 +29,7 @@ IWA_COLLIDE_DAMAGE = 30
 MID_BOSS_SPAWN_SCORE = 5    # 中ボス出现阈值（改为50也可）
 
 # --- 初始化 ---
-pygame.init()
-pygame.font.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Xevious Style Shooter (V-fixed, MidBoss hits)")
-clock = pygame.time.Clock()
-
-# --- 资源加载（安全）---
-if not os.path.exists(fig_dir):
-    os.makedirs(fig_dir)
-
+# import しただけでは画面を作らない (init() は main() から呼ぶ)
 def safe_load(path, fallback_size=(40,40), fillcolor=(120,120,120)):
     try:
         return pygame.image.load(path).convert_alpha()
@@ -47,41 +38,114 @@ def safe_load(path, fallback_size=(40,40), fillcolor=(120,120,120)):
         surf.fill(fillcolor)
         return surf
 
-PLAYER_IMAGE = safe_load(os.path.join(fig_dir, "koukaton.png"), (40,40))
-ENEMY_IMAGE = safe_load(os.path.join(fig_dir, "enemy.png"), (40,40))
-PLAYER_BULLET_IMAGE = safe_load(os.path.join(fig_dir, "beam.png"), (25,15))
-ENEMY_BULLET_IMAGE = safe_load(os.path.join(fig_dir, "beam.png"), (30,15))
-IWA_IMAGE = safe_load(os.path.join(fig_dir, "iwa_01.png"), (100,100))
-LAZER_IMAGE = safe_load(os.path.join(fig_dir, "lazer.png"), (20, SCREEN_HEIGHT))
-HEAL_ITEM_IMAGE = safe_load(os.path.join(fig_dir, "heal.png"), (30,30))
-ATTACK_ITEM_IMAGE = safe_load(os.path.join(fig_dir, "attack.png"), (30,30))
-EXPLOSION_IMAGE_SINGLE = safe_load(os.path.join(fig_dir, "explosion.gif"), (60,60))
-BOSS_IMAGE = safe_load(os.path.join(fig_dir, "boss.png"), (120,100))
+# --- 变形后图像缓存：(原图, 尺寸, 旋转, 着色) 只生成一次 ---
+class SurfaceCache:
+    def __init__(self):
+        self.surfaces = {}
+        self.hits = 0; self.misses = 0
+
+    def get(self, image, size=None, angle=0, tint=None):
+        key = (image, size, angle, tint)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = image
+        if size is not None: surf = pygame.transform.scale(surf, size)
+        if angle: surf = pygame.transform.rotate(surf, angle)
+        if tint is not None:
+            if surf is image: surf = image.copy()
+            col = pygame.Surface(surf.get_size(), pygame.SRCALPHA); col.fill(tint)
+            surf.blit(col, (0,0), special_flags=pygame.BLEND_RGBA_MULT)
+        self.surfaces[key] = surf
+        return surf
+
+surface_cache = SurfaceCache()
+
+# 弾の見た目 (サイズ, 回転角, 色)。元画像は beam.png
+PLAYER_BULLET_VARIANT = ((25,15), 90, None)
+CHARGE_SHOT_VARIANT = ((120,60), 90, RED)
+ENEMY_BULLET_VARIANT = ((30,15), -90, YELLOW)
+
+# 画像は最初に使うときに読み込み、以後は同じサーフェスを使い回す
+# convert_alpha() を使うので init() で画面を作った後に呼ぶ
+images = {}
+
+def load_image(name, fallback_size):
+    key = (name, fallback_size)
+    surf = images.get(key)
+    if surf is None:
+        surf = safe_load(os.path.join(fig_dir, name), fallback_size)
+        images[key] = surf
+    return surf
+
+# 爆発アニメのコマ (explosion_00.png ～)。無ければ explosion.gif 1 枚
+explosion_frames = None
+
+def load_explosion_frames():
+    global explosion_frames
+    if explosion_frames is None:
+        explosion_frames = []
+        for i in range(100):
+            p = os.path.join(fig_dir, f"explosion_{i:02d}.png")
+            if os.path.exists(p):
+                try:
+                    explosion_frames.append(pygame.image.load(p).convert_alpha())
+                except Exception:
+                    pass
+        if not explosion_frames:
+            explosion_frames = [load_image("explosion.gif", (60,60))]
+    return explosion_frames
 
 # 优先加载 super_enemy.png
-if os.path.exists(os.path.join(fig_dir, "super_enemy.png")):
-    MID_BOSS_IMAGE = safe_load(os.path.join(fig_dir, "super_enemy.png"), (120,120))
-else:
-    MID_BOSS_IMAGE = safe_load(os.path.join(fig_dir, "final_enemy.png"), (120,120))
-
-# explosion frames
-EXPLOSION_FRAMES = []
-for i in range(100):
-    p = os.path.join(fig_dir, f"explosion_{i:02d}.png")
-    if os.path.exists(p):
-        try:
-            EXPLOSION_FRAMES.append(pygame.image.load(p).convert_alpha())
-        except Exception:
-            pass
-if not EXPLOSION_FRAMES:
-    EXPLOSION_FRAMES = [EXPLOSION_IMAGE_SINGLE]
-
-# --- 字体 ---
-score_font = pygame.font.SysFont(None, 36)
-game_over_font = pygame.font.SysFont(None, 64, bold=True)
-boss_font = pygame.font.SysFont(None, 48, bold=True)
-boss_warning_font = pygame.font.SysFont(None, 72, bold=True)
-info_font = pygame.font.SysFont(None, 30)
+def mid_boss_image_name():
+    return "super_enemy.png" if os.path.exists(os.path.join(fig_dir, "super_enemy.png")) else "final_enemy.png"
+
+# 最初のフレームを出した後に呼び、残りの画像も読み込んでおく (ボスの出現時などにゲーム中で読み込まないように)
+def preload_images():
+    for name, size in (
+        ("lazer.png", (20, SCREEN_HEIGHT)),
+        ("heal.png", (30,30)),
+        ("attack.png", (30,30)),
+        ("explosion.gif", (60,60)),
+        ("boss.png", (120,100)),
+        (mid_boss_image_name(), (120,120)),
+    ):
+        load_image(name, size)
+    load_explosion_frames()
+
+# フォントは最初に使うときに作る (名前: (大きさ, 太字))
+# SysFont(None, ...) はシステムのフォント一覧を調べるので、同じ既定のフォントを Font(None, ...) で作る
+FONT_SPECS = {
+    "score": (36, False),
+    "game_over": (64, True),
+    "boss": (48, True),
+    "boss_warning": (72, True),
+    "info": (30, False),
+}
+fonts = {}
+
+def get_font(name):
+    font = fonts.get(name)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        size, bold = FONT_SPECS[name]
+        font = pygame.font.Font(None, size)
+        font.set_bold(bold)
+        fonts[name] = font
+    return font
+
+def init():
+    global screen, clock
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Xevious Style Shooter (V-fixed, MidBoss hits)")
+    clock = pygame.time.Clock()
+
+    if not os.path.exists(fig_dir):
+        os.makedirs(fig_dir)
 
 # --- 帮助函数 ---
 def draw_text(surface, text, font, color, x, y, align="topright"):
@@ -130,7 +194,7 @@ def draw_health_bar(surface, x, y, pct):
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pygame.transform.scale(PLAYER_IMAGE, (40,40))
+        self.image = pygame.transform.scale(load_image("koukaton.png", (40,40)), (40,40))
         self.rect = self.image.get_rect(centerx=SCREEN_WIDTH//2, bottom=SCREEN_HEIGHT-30)
         self.speed_x = 0
         self.hidden = False
@@ -220,7 +284,7 @@ class Player(pygame.sprite.Sprite):
 class Enemy(pygame.sprite.Sprite):
     def __init__(self, speed_level=0, all_sprites_ref=None, enemy_bullets_group_ref=None):
         super().__init__()
-        self.image = pygame.transform.scale(ENEMY_IMAGE, (40,40))
+        self.image = pygame.transform.scale(load_image("enemy.png", (40,40)), (40,40))
         self.rect = self.image.get_rect(x=random.randrange(0, SCREEN_WIDTH-40), y=random.randrange(-100,-40))
         base_min, base_max = 2, 5
         inc = speed_level * 0.4
@@ -251,7 +315,7 @@ class BigEnemy(Enemy):
     def __init__(self, speed_level=0, all_sprites_ref=None, enemy_bullets_group_ref=None, player_ref=None):
         super().__init__(speed_level, all_sprites_ref, enemy_bullets_group_ref)
         self.player = player_ref
-        self.image = pygame.transform.scale(BOSS_IMAGE, (120,100))
+        self.image = pygame.transform.scale(load_image("boss.png", (120,100)), (120,100))
         self.rect = self.image.get_rect(x=(SCREEN_WIDTH-120)//2, y=-100)
         self.speed_y = 1; self.speed_x = 3; self.target_y = 100
         self.health = 30; self.score_value = 50
@@ -281,7 +345,7 @@ class BigEnemy(Enemy):
 class Iwa(pygame.sprite.Sprite):
     def __init__(self, speed_level=0, all_sprites_ref=None):
         super().__init__()
-        self.image = pygame.transform.scale(IWA_IMAGE, (100,100))
+        self.image = pygame.transform.scale(load_image("iwa_01.png", (100,100)), (100,100))
         self.rect = self.image.get_rect(x=random.randrange(0, SCREEN_WIDTH-100), y=random.randrange(-100,-40))
         base_min, base_max = 5, 9
         inc = speed_level * 0.4
@@ -298,8 +362,7 @@ class Iwa(pygame.sprite.Sprite):
 class PlayerBullet(pygame.sprite.Sprite):
     def __init__(self, x, y, speed_x=0):
         super().__init__()
-        raw = pygame.transform.scale(PLAYER_BULLET_IMAGE, (25,15))
-        self.image = pygame.transform.rotate(raw, 90)
+        self.image = surface_cache.get(load_image("beam.png", (25,15)), *PLAYER_BULLET_VARIANT)
         self.rect = self.image.get_rect(bottom=y, centerx=x)
         self.speed_y = -10; self.speed_x = speed_x
 
@@ -310,10 +373,7 @@ class PlayerBullet(pygame.sprite.Sprite):
 class PlayerChargeShot(pygame.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        raw = pygame.transform.scale(PLAYER_BULLET_IMAGE, (120,60))
-        self.image = pygame.transform.rotate(raw, 90)
-        cs = pygame.Surface(self.image.get_size(), pygame.SRCALPHA); cs.fill(RED)
-        self.image.blit(cs, (0,0), special_flags=pygame.BLEND_RGBA_MULT)
+        self.image = surface_cache.get(load_image("beam.png", (25,15)), *CHARGE_SHOT_VARIANT)
         self.rect = self.image.get_rect(bottom=y, centerx=x)
         self.speed_y = -12
 
@@ -324,10 +384,7 @@ class PlayerChargeShot(pygame.sprite.Sprite):
 class EnemyBullet(pygame.sprite.Sprite):
     def __init__(self, x, y, speed_y_val=7, player_ref=None):
         super().__init__()
-        raw = pygame.transform.scale(ENEMY_BULLET_IMAGE, (30,15))
-        self.image = pygame.transform.rotate(raw, -90)
-        col = pygame.Surface(self.image.get_size(), pygame.SRCALPHA); col.fill(YELLOW)
-        self.image.blit(col, (0,0), special_flags=pygame.BLEND_RGBA_MULT)
+        self.image = surface_cache.get(load_image("beam.png", (30,15)), *ENEMY_BULLET_VARIANT)
         self.rect = self.image.get_rect(top=y, centerx=x)
         self.speed_y = speed_y_val; self.speed_x = 0; self.player = player_ref
         if self.player and not getattr(self.player, "hidden", False) and self.player.rect.centery > self.rect.centery:
@@ -349,7 +406,7 @@ class SuperLaser(pygame.sprite.Sprite):
     def __init__(self, player_obj):
         super().__init__()
         self.player = player_obj
-        self.image = pygame.transform.scale(LAZER_IMAGE, (20, SCREEN_HEIGHT))
+        self.image = pygame.transform.scale(load_image("lazer.png", (20, SCREEN_HEIGHT)), (20, SCREEN_HEIGHT))
         self.rect = self.image.get_rect()
         self.update()
 
@@ -369,28 +426,28 @@ class Item(pygame.sprite.Sprite):
 
 class HealItem(Item):
     def __init__(self, center):
-        self.image = pygame.transform.scale(HEAL_ITEM_IMAGE, (30,30)); super().__init__(center)
+        self.image = pygame.transform.scale(load_image("heal.png", (30,30)), (30,30)); super().__init__(center)
     def apply_effect(self, player): player.heal(25)
 
 class AttackUpItem(Item):
     def __init__(self, center):
-        self.image = pygame.transform.scale(ATTACK_ITEM_IMAGE, (30,30)); super().__init__(center)
+        self.image = pygame.transform.scale(load_image("attack.png", (30,30)), (30,30)); super().__init__(center)
     def apply_effect(self, player): player.power_up()
 
 class Explosion(pygame.sprite.Sprite):
     def __init__(self, center, size="normal", is_anime=True):
         super().__init__()
         self.is_anime = is_anime
-        if self.is_anime and EXPLOSION_FRAMES:
+        if self.is_anime and load_explosion_frames():
             scale = (90,90) if size=="large" else (60,60)
-            self.frames = [pygame.transform.scale(f, scale) for f in EXPLOSION_FRAMES]
+            self.frames = [pygame.transform.scale(f, scale) for f in load_explosion_frames()]
             self.frame_rate = 70; self.current_frame = 0
             self.image = self.frames[self.current_frame]; self.rect = self.image.get_rect(center=center)
             self.last_update = pygame.time.get_ticks()
         else:
             self.is_anime = False
             scale = (90,90) if size=="large" else (60,60)
-            self.image = pygame.transform.scale(EXPLOSION_IMAGE_SINGLE, scale)
+            self.image = pygame.transform.scale(load_image("explosion.gif", (60,60)), scale)
             self.rect = self.image.get_rect(center=center); self.duration = 400; self.creation_time = pygame.time.get_ticks()
 
     def update(self):
@@ -407,7 +464,7 @@ class Explosion(pygame.sprite.Sprite):
 class MidBoss(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.original_image = pygame.transform.scale(MID_BOSS_IMAGE, (120,120))
+        self.original_image = pygame.transform.scale(load_image(mid_boss_image_name(), (120,120)), (120,120))
         self.image = self.original_image
         self.rect = self.image.get_rect()
         self.rect.centerx = SCREEN_WIDTH // 2
@@ -506,260 +563,272 @@ class MidBossBullet(pygame.sprite.Sprite):
             self.rect.left > SCREEN_WIDTH + 60 or self.rect.right < -60):
             self.kill()
 
-# === 初始化组/变量 ===
-stars = create_stars(100)
-all_sprites = pygame.sprite.Group()
-enemies_group = pygame.sprite.Group()
-player_bullets_group = pygame.sprite.Group()
-player_charge_bullets_group = pygame.sprite.Group()
-enemy_bullets_group = pygame.sprite.Group()
-iwa_group = pygame.sprite.Group()
-items_group = pygame.sprite.Group()
-laser_group = pygame.sprite.Group()
-mid_boss_group = pygame.sprite.Group()
-
-player = Player()
-all_sprites.add(player)
-
-ADD_ENEMY = pygame.USEREVENT + 1
-initial_spawn_rate = 1000
-current_spawn_rate = initial_spawn_rate
-pygame.time.set_timer(ADD_ENEMY, initial_spawn_rate)
-
-score = 0; game_speed_level = 0; game_over = False; running = True
-level_up_message_time = 0
-boss_spawned = False; boss_spawn_time = 30000; boss_warning_time = 0
-game_start_time = pygame.time.get_ticks()
-
-mid_boss_spawned = False; mid_boss_defeated = False; mid_boss_warning_timer = 0
-
-# --- 主循环（注意：事件驱动 V）---
-while running:
-    clock.tick(FPS)
-    now = pygame.time.get_ticks()
-
-    # 事件
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-        # 按任意键在 game over 时退出
-        elif game_over and event.type == pygame.KEYDOWN:
-            running = False
-
-        # 定时刷怪
-        elif event.type == ADD_ENEMY and not game_over:
-            if not mid_boss_spawned or mid_boss_defeated:
-                e = Enemy(game_speed_level, all_sprites, enemy_bullets_group)
-                all_sprites.add(e); enemies_group.add(e)
-                iw = Iwa(game_speed_level, all_sprites)
-                all_sprites.add(iw); iwa_group.add(iw)
-
-        # === 蓄力事件：KEYDOWN 开始、KEYUP 释放 ===
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_v and not game_over and not player.hidden:
-                # 开始充能
-                player.is_charging = True
-                player.charge_start_time = now
-                player.charge_value = 0
-        elif event.type == pygame.KEYUP:
-            if event.key == pygame.K_v and not game_over and not player.hidden and player.is_charging:
-                # 释放：结算并发射（满充 -> 蓄力弹；否则 -> 普通弹）
+def main():
+    global all_sprites, enemy_bullets_group
+    init()
+    # === 初始化组/变量 ===
+    stars = create_stars(100)
+    all_sprites = pygame.sprite.Group()
+    enemies_group = pygame.sprite.Group()
+    player_bullets_group = pygame.sprite.Group()
+    player_charge_bullets_group = pygame.sprite.Group()
+    enemy_bullets_group = pygame.sprite.Group()
+    iwa_group = pygame.sprite.Group()
+    items_group = pygame.sprite.Group()
+    laser_group = pygame.sprite.Group()
+    mid_boss_group = pygame.sprite.Group()
+
+    player = Player()
+    all_sprites.add(player)
+
+    ADD_ENEMY = pygame.USEREVENT + 1
+    initial_spawn_rate = 1000
+    current_spawn_rate = initial_spawn_rate
+    pygame.time.set_timer(ADD_ENEMY, initial_spawn_rate)
+
+    score = 0; game_speed_level = 0; game_over = False; running = True
+    level_up_message_time = 0
+    boss_spawned = False; boss_spawn_time = 30000; boss_warning_time = 0
+    game_start_time = pygame.time.get_ticks()
+
+    mid_boss_spawned = False; mid_boss_defeated = False; mid_boss_warning_timer = 0
+
+    first_frame = True
+
+    # --- 主循环（注意：事件驱动 V）---
+    while running:
+        clock.tick(FPS)
+        now = pygame.time.get_ticks()
+
+        # 事件
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+            # 按任意键在 game over 时退出
+            elif game_over and event.type == pygame.KEYDOWN:
+                running = False
+
+            # 定时刷怪
+            elif event.type == ADD_ENEMY and not game_over:
+                if not mid_boss_spawned or mid_boss_defeated:
+                    e = Enemy(game_speed_level, all_sprites, enemy_bullets_group)
+                    all_sprites.add(e); enemies_group.add(e)
+                    iw = Iwa(game_speed_level, all_sprites)
+                    all_sprites.add(iw); iwa_group.add(iw)
+
+            # === 蓄力事件：KEYDOWN 开始、KEYUP 释放 ===
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_v and not game_over and not player.hidden:
+                    # 开始充能
+                    player.is_charging = True
+                    player.charge_start_time = now
+                    player.charge_value = 0
+            elif event.type == pygame.KEYUP:
+                if event.key == pygame.K_v and not game_over and not player.hidden and player.is_charging:
+                    # 释放：结算并发射（满充 -> 蓄力弹；否则 -> 普通弹）
+                    player.charge_value = min(now - player.charge_start_time, player.charge_max_time)
+                    if player.charge_value >= player.charge_max_time:
+                        player.shoot_charge_shot(all_sprites, player_charge_bullets_group)
+                    else:
+                        player.shoot(all_sprites, player_bullets_group, now)
+                    player.is_charging = False
+                    player.charge_value = 0
+        # keys 轮询（用于移动与空格）
+        keys = pygame.key.get_pressed()
+
+        # --- 更新逻辑 ---
+        if not game_over:
+            # 保证 player.update 一直被调用（其中不再处理 K_v）
+            player.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
+
+            # 若玩家处于正在充能状态，实时更新 charge_value 以显示进度
+            if player.is_charging:
                 player.charge_value = min(now - player.charge_start_time, player.charge_max_time)
-                if player.charge_value >= player.charge_max_time:
-                    player.shoot_charge_shot(all_sprites, player_charge_bullets_group)
+
+            # 激光
+            if player.powerup_level >= 2:
+                if keys[pygame.K_SPACE]:
+                    if not player.active_laser:
+                        player.active_laser = SuperLaser(player)
+                        all_sprites.add(player.active_laser); laser_group.add(player.active_laser)
                 else:
-                    player.shoot(all_sprites, player_bullets_group, now)
-                player.is_charging = False
-                player.charge_value = 0
-    # keys 轮询（用于移动与空格）
-    keys = pygame.key.get_pressed()
-
-    # --- 更新逻辑 ---
-    if not game_over:
-        # 保证 player.update 一直被调用（其中不再处理 K_v）
-        player.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
-
-        # 若玩家处于正在充能状态，实时更新 charge_value 以显示进度
-        if player.is_charging:
-            player.charge_value = min(now - player.charge_start_time, player.charge_max_time)
-
-        # 激光
-        if player.powerup_level >= 2:
-            if keys[pygame.K_SPACE]:
-                if not player.active_laser:
-                    player.active_laser = SuperLaser(player)
-                    all_sprites.add(player.active_laser); laser_group.add(player.active_laser)
+                    if player.active_laser:
+                        player.active_laser.kill(); player.active_laser = None
             else:
                 if player.active_laser:
                     player.active_laser.kill(); player.active_laser = None
-        else:
-            if player.active_laser:
-                player.active_laser.kill(); player.active_laser = None
-
-        # BigEnemy 时间控制（保留）
-        elapsed_time = now - game_start_time
-        if elapsed_time > (boss_spawn_time - 2000) and not boss_spawned and boss_warning_time == 0:
-            boss_warning_time = now
-        if elapsed_time > boss_spawn_time and not boss_spawned:
-            boss = BigEnemy(game_speed_level, all_sprites, enemy_bullets_group, player)
-            all_sprites.add(boss); enemies_group.add(boss)
-            boss_spawned = True; boss_warning_time = 0
-            pygame.time.set_timer(ADD_ENEMY, 0)
-
-        # 中ボス出现
-        if score >= MID_BOSS_SPAWN_SCORE and not mid_boss_spawned and not mid_boss_defeated:
-            mid_boss_spawned = True; mid_boss_warning_timer = 180
-            mid_boss = MidBoss()
-            all_sprites.add(mid_boss); mid_boss_group.add(mid_boss)
-            pygame.time.set_timer(ADD_ENEMY, 0)
-            print("中ボス出現！")
-
-        if mid_boss_warning_timer > 0:
-            mid_boss_warning_timer -= 1
-
-        # 更新除 player 之外的所有精灵
-        sprites_to_update = [s for s in all_sprites if s is not player]
-        for s in sprites_to_update:
-            try:
-                s.update()
-            except TypeError:
-                try:
-                    s.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
-                except Exception:
-                    pass
-    else:
-        # game over 时仍更新爆炸动画
-        for s in list(all_sprites):
-            if isinstance(s, Explosion):
-                s.update()
-
-    # --- 碰撞判定 ---
-    if not game_over:
-        enemies_destroyed = 0
-
-        # 普通子弹命中普通敌人
-        hits_normal = pygame.sprite.groupcollide(player_bullets_group, enemies_group, True, False)
-        hits_charge = pygame.sprite.groupcollide(player_charge_bullets_group, enemies_group, False, False)
-        hits_laser = pygame.sprite.groupcollide(laser_group, enemies_group, False, True)
-
-        for bullet, hit_list in {**hits_normal, **hits_charge}.items():
-            for enemy_hit in hit_list:
-                if enemy_hit.hit():
-                    all_sprites.add(Explosion(enemy_hit.rect.center, "normal"))
-                    score += enemy_hit.score_value
-                    enemies_destroyed += 1
-                    enemy_hit.kill()
-                    if random.random() > 0.8:
-                        it = random.choice([HealItem, AttackUpItem])(enemy_hit.rect.center)
-                        all_sprites.add(it); items_group.add(it)
-
-        for laser, hit_list in hits_laser.items():
-            for e in hit_list:
-                all_sprites.add(Explosion(e.rect.center, "normal"))
-                score += getattr(e, "score_value", 1)
-
-        # --- 新增：玩家普通弹/蓄力弹命中中ボス ---
-        if mid_boss_spawned and not mid_boss_defeated:
-            mb_hits = pygame.sprite.groupcollide(player_bullets_group, mid_boss_group, True, False)
-            for bullet, mbs in mb_hits.items():
-                for mb in mbs:
-                    if mb.hit():
-                        all_sprites.add(Explosion(mb.rect.center, "large"))
-                        score += mb.score_value
-                        mid_boss_defeated = True
-                        mb.kill()
-                        print("中ボス撃破！")
-                        pygame.time.set_timer(ADD_ENEMY, current_spawn_rate)
-
-            mb_hits_charge = pygame.sprite.groupcollide(player_charge_bullets_group, mid_boss_group, False, False)
-            for bullet, mbs in mb_hits_charge.items():
-                for mb in mbs:
-                    if mb.hit():
-                        all_sprites.add(Explosion(mb.rect.center, "large"))
-                        score += mb.score_value
-                        mid_boss_defeated = True
-                        mb.kill()
-                        print("中ボス撃破！（蓄力）")
-                        pygame.time.set_timer(ADD_ENEMY, current_spawn_rate)
-
-        # 刷新速率调整
-        if enemies_destroyed > 0 and not boss_spawned:
-            new_level = score // 10
-            if new_level > game_speed_level:
-                game_speed_level = new_level
-                level_up_message_time = pygame.time.get_ticks()
-                rate = max(150, int(initial_spawn_rate * (0.9 ** game_speed_level)))
+
+            # BigEnemy 时间控制（保留）
+            elapsed_time = now - game_start_time
+            if elapsed_time > (boss_spawn_time - 2000) and not boss_spawned and boss_warning_time == 0:
+                boss_warning_time = now
+            if elapsed_time > boss_spawn_time and not boss_spawned:
+                boss = BigEnemy(game_speed_level, all_sprites, enemy_bullets_group, player)
+                all_sprites.add(boss); enemies_group.add(boss)
+                boss_spawned = True; boss_warning_time = 0
                 pygame.time.set_timer(ADD_ENEMY, 0)
-                pygame.time.set_timer(ADD_ENEMY, rate)
 
-        # 玩家与敌机碰撞
-        player_enemy_hits = pygame.sprite.spritecollide(player, enemies_group, True)
-        if player_enemy_hits:
-            if player.take_damage(PLAYER_COLLIDE_DAMAGE):
-                game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal"))
-
-        # 玩家与敌方子弹碰撞（包含 MidBoss 与 BigEnemy 的子弹） -> 统一伤害 ENEMY_BULLET_DAMAGE
-        player_beam_hits = pygame.sprite.spritecollide(player, enemy_bullets_group, True)
-        if player_beam_hits:
-            dmg = ENEMY_BULLET_DAMAGE * len(player_beam_hits)
-            if player.take_damage(dmg):
-                game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal"))
+            # 中ボス出现
+            if score >= MID_BOSS_SPAWN_SCORE and not mid_boss_spawned and not mid_boss_defeated:
+                mid_boss_spawned = True; mid_boss_warning_timer = 180
+                mid_boss = MidBoss()
+                all_sprites.add(mid_boss); mid_boss_group.add(mid_boss)
+                pygame.time.set_timer(ADD_ENEMY, 0)
+                print("中ボス出現！")
 
-        # 玩家与岩石碰撞
-        player_iwa_hits = pygame.sprite.spritecollide(player, iwa_group, True)
-        if player_iwa_hits:
-            if player.take_damage(IWA_COLLIDE_DAMAGE):
-                game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal"))
+            if mid_boss_warning_timer > 0:
+                mid_boss_warning_timer -= 1
+
+            # 更新除 player 之外的所有精灵
+            sprites_to_update = [s for s in all_sprites if s is not player]
+            for s in sprites_to_update:
+                try:
+                    s.update()
+                except TypeError:
+                    try:
+                        s.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
+                    except Exception:
+                        pass
+        else:
+            # game over 时仍更新爆炸动画
+            for s in list(all_sprites):
+                if isinstance(s, Explosion):
+                    s.update()
+
+        # --- 碰撞判定 ---
+        if not game_over:
+            enemies_destroyed = 0
+
+            # 普通子弹命中普通敌人
+            hits_normal = pygame.sprite.groupcollide(player_bullets_group, enemies_group, True, False)
+            hits_charge = pygame.sprite.groupcollide(player_charge_bullets_group, enemies_group, False, False)
+            hits_laser = pygame.sprite.groupcollide(laser_group, enemies_group, False, True)
+
+            for bullet, hit_list in {**hits_normal, **hits_charge}.items():
+                for enemy_hit in hit_list:
+                    if enemy_hit.hit():
+                        all_sprites.add(Explosion(enemy_hit.rect.center, "normal"))
+                        score += enemy_hit.score_value
+                        enemies_destroyed += 1
+                        enemy_hit.kill()
+                        if random.random() > 0.8:
+                            it = random.choice([HealItem, AttackUpItem])(enemy_hit.rect.center)
+                            all_sprites.add(it); items_group.add(it)
+
+            for laser, hit_list in hits_laser.items():
+                for e in hit_list:
+                    all_sprites.add(Explosion(e.rect.center, "normal"))
+                    score += getattr(e, "score_value", 1)
+
+            # --- 新增：玩家普通弹/蓄力弹命中中ボス ---
+            if mid_boss_spawned and not mid_boss_defeated:
+                mb_hits = pygame.sprite.groupcollide(player_bullets_group, mid_boss_group, True, False)
+                for bullet, mbs in mb_hits.items():
+                    for mb in mbs:
+                        if mb.hit():
+                            all_sprites.add(Explosion(mb.rect.center, "large"))
+                            score += mb.score_value
+                            mid_boss_defeated = True
+                            mb.kill()
+                            print("中ボス撃破！")
+                            pygame.time.set_timer(ADD_ENEMY, current_spawn_rate)
+
+                mb_hits_charge = pygame.sprite.groupcollide(player_charge_bullets_group, mid_boss_group, False, False)
+                for bullet, mbs in mb_hits_charge.items():
+                    for mb in mbs:
+                        if mb.hit():
+                            all_sprites.add(Explosion(mb.rect.center, "large"))
+                            score += mb.score_value
+                            mid_boss_defeated = True
+                            mb.kill()
+                            print("中ボス撃破！（蓄力）")
+                            pygame.time.set_timer(ADD_ENEMY, current_spawn_rate)
+
+            # 刷新速率调整
+            if enemies_destroyed > 0 and not boss_spawned:
+                new_level = score // 10
+                if new_level > game_speed_level:
+                    game_speed_level = new_level
+                    level_up_message_time = pygame.time.get_ticks()
+                    rate = max(150, int(initial_spawn_rate * (0.9 ** game_speed_level)))
+                    pygame.time.set_timer(ADD_ENEMY, 0)
+                    pygame.time.set_timer(ADD_ENEMY, rate)
+
+            # 玩家与敌机碰撞
+            player_enemy_hits = pygame.sprite.spritecollide(player, enemies_group, True)
+            if player_enemy_hits:
+                if player.take_damage(PLAYER_COLLIDE_DAMAGE):
+                    game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
+                else:
+                    all_sprites.add(Explosion(player.rect.center, "normal"))
+
+            # 玩家与敌方子弹碰撞（包含 MidBoss 与 BigEnemy 的子弹） -> 统一伤害 ENEMY_BULLET_DAMAGE
+            player_beam_hits = pygame.sprite.spritecollide(player, enemy_bullets_group, True)
+            if player_beam_hits:
+                dmg = ENEMY_BULLET_DAMAGE * len(player_beam_hits)
+                if player.take_damage(dmg):
+                    game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
+                else:
+                    all_sprites.add(Explosion(player.rect.center, "normal"))
+
+            # 玩家与岩石碰撞
+            player_iwa_hits = pygame.sprite.spritecollide(player, iwa_group, True)
+            if player_iwa_hits:
+                if player.take_damage(IWA_COLLIDE_DAMAGE):
+                    game_over = True; all_sprites.add(Explosion(player.rect.center, "large")); player.hide()
+                else:
+                    all_sprites.add(Explosion(player.rect.center, "normal"))
+
+            # 道具拾取
+            for it in pygame.sprite.spritecollide(player, items_group, True):
+                it.apply_effect(player)
 
-        # 道具拾取
-        for it in pygame.sprite.spritecollide(player, items_group, True):
-            it.apply_effect(player)
+            # 玩家与中ボス实体碰撞
+            if mid_boss_spawned and not mid_boss_defeated:
+                player_mid_hits = pygame.sprite.spritecollide(player, mid_boss_group, False)
+                if player_mid_hits:
+                    all_sprites.add(Explosion(player.rect.center, "large")); player.hide(); game_over = True
+                    pygame.time.set_timer(ADD_ENEMY, 0)
+
+        # --- 绘制 ---
+        screen.fill(BLACK)
+        draw_stars(screen, stars, game_speed_level)
+        all_sprites.draw(screen)
 
-        # 玩家与中ボス实体碰撞
         if mid_boss_spawned and not mid_boss_defeated:
-            player_mid_hits = pygame.sprite.spritecollide(player, mid_boss_group, False)
-            if player_mid_hits:
-                all_sprites.add(Explosion(player.rect.center, "large")); player.hide(); game_over = True
-                pygame.time.set_timer(ADD_ENEMY, 0)
+            for mb in mid_boss_group:
+                mb.draw_health_bar(screen)
 
-    # --- 绘制 ---
-    screen.fill(BLACK)
-    draw_stars(screen, stars, game_speed_level)
-    all_sprites.draw(screen)
+        draw_text(screen, f"SCORE: {score}", get_font("score"), WHITE, SCREEN_WIDTH-10, 10, align="topright")
+        draw_text(screen, f"LEVEL: {game_speed_level}", get_font("score"), WHITE, 10, 10, align="topleft")
+        draw_health_bar(screen, 10, 40, player.health)
+        # 充能槽：当正在充能或有残余值时显示
+        if not player.hidden and (player.is_charging or player.charge_value > 0):
+            draw_charge_gauge(screen, player.charge_value, player.charge_max_time, player.rect.bottom)
 
-    if mid_boss_spawned and not mid_boss_defeated:
-        for mb in mid_boss_group:
-            mb.draw_health_bar(screen)
+        if pygame.time.get_ticks() - level_up_message_time < 1000 and not game_over:
+            draw_text(screen, "LEVEL UP!", get_font("game_over"), YELLOW, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
 
-    draw_text(screen, f"SCORE: {score}", score_font, WHITE, SCREEN_WIDTH-10, 10, align="topright")
-    draw_text(screen, f"LEVEL: {game_speed_level}", score_font, WHITE, 10, 10, align="topleft")
-    draw_health_bar(screen, 10, 40, player.health)
-    # 充能槽：当正在充能或有残余值时显示
-    if not player.hidden and (player.is_charging or player.charge_value > 0):
-        draw_charge_gauge(screen, player.charge_value, player.charge_max_time, player.rect.bottom)
+        if boss_warning_time > 0 and not game_over and (pygame.time.get_ticks() - boss_warning_time) % 1000 < 500:
+            draw_text(screen, "!! WARNING !!", get_font("boss_warning"), RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
 
-    if 'level_up_message_time' in globals() and pygame.time.get_ticks() - level_up_message_time < 1000 and not game_over:
-        draw_text(screen, "LEVEL UP!", game_over_font, YELLOW, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
+        if mid_boss_warning_timer > 0 and mid_boss_warning_timer % 30 < 15:
+            draw_text(screen, "A mid-boss appears!", get_font("boss"), RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//3, align="center")
 
-    if boss_warning_time > 0 and not game_over and (pygame.time.get_ticks() - boss_warning_time) % 1000 < 500:
-        draw_text(screen, "!! WARNING !!", boss_warning_font, RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
+        if game_over:
+            draw_text(screen, "GAME OVER", get_font("game_over"), RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
+            draw_text(screen, "Press any key to exit", get_font("info"), WHITE, SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 50, align="center")
 
-    if mid_boss_warning_timer > 0 and mid_boss_warning_timer % 30 < 15:
-        draw_text(screen, "A mid-boss appears!", boss_font, RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//3, align="center")
+        pygame.display.flip()
+        if first_frame:
+            first_frame = False
+            preload_images()
 
-    if game_over:
-        draw_text(screen, "GAME OVER", game_over_font, RED, SCREEN_WIDTH//2, SCREEN_HEIGHT//2, align="center")
-        draw_text(screen, "Press any key to exit", info_font, WHITE, SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 50, align="center")
+    # 退出
+    pygame.quit()
 
-    pygame.display.flip()
 
-# 退出
-pygame.quit()
-sys.exit()
+if __name__ == "__main__":
+    main()
+    sys.exit()
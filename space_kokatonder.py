@@ -1,8 +1,22 @@
+import argparse
+import bisect
+from collections import OrderedDict
+import csv
+import hashlib
+import heapq
+import json
 import math
+import mmap
 import os
 import pygame as pg
 import random
 import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # スクリプトのパスを基準にディレクトリを設定
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,7 +25,11 @@ fig_dir = os.path.join(script_dir, "fig")
 # 定数
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 800
+SCREEN_RECT = pg.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
 FPS = 60
+# 描画が遅れたときに 1 回の描画の間に進めるシミュレーションの最大ステップ数と、1 回に取り込む最大の経過時間 (秒)
+MAX_CATCHUP_STEPS = 5
+MAX_FRAME_TIME = 0.25
 
 # 色
 WHITE = (255, 255, 255)
@@ -22,66 +40,819 @@ GREEN = (0, 255, 0)
 GRAY = (100, 100, 100)
 CYAN = (0, 255, 255)
 
+# True にすると中ボスの弾を NumPy の配列でまとめて動かす (numpy が必要)
+USE_BULLET_FIELD = False
+# False にすると当たり判定を pygame の groupcollide/spritecollide で総当たりする (比較用)
+USE_SPATIAL_HASH = True
+# False にすると自機の弾と敵の当たり判定をフレームごとの矩形の重なりだけで行う (True なら 1 ステップ分の移動を線分として調べる)
+USE_SWEPT_COLLISION = True
+# False にすると自機への当たり判定を矩形だけで行う (True なら矩形で重なった組だけ画素単位で確かめる)
+USE_PIXEL_COLLISION = True
+# False にするとデコード済み画像のキャッシュ (.asset_cache/) を使わず、毎回 PNG/GIF をデコードする
+USE_ASSET_CACHE = True
+
 # 意味深な叫び声
 call = "逃げるなァ!!!!!逃げるな卑怯者!!!!!"
 
+# コマンドライン引数
+parser = argparse.ArgumentParser(description="スペースこうかとんダー")
+parser.add_argument("--headless", action="store_true", help="画面を出さずに仮想時計で最速実行する")
+parser.add_argument("--frames", type=int, default=0, help="このフレーム数で終了する (0 は無制限)")
+parser.add_argument("--invincible", action="store_true", help="自機がダメージを受けない")
+parser.add_argument("--seed", type=int, default=None, help="乱数のシード (指定すると同じ入力なら毎回同じ展開になる)")
+parser.add_argument("--dirty", action="store_true", help="変化した部分だけを画面に送る描画モード")
+parser.add_argument("--star-density", type=float, default=1.0, help="背景の星の数の倍率")
+parser.add_argument("--profile-csv", default=None, help="終了時にフレームプロファイルを CSV に書き出す")
+parser.add_argument("--bench", nargs="*", metavar="SCENARIO", help="ベンチマークを実行する (名前を省略すると全シナリオ)")
+parser.add_argument("--bench-frames", type=int, default=600, help="1 シナリオあたりの計測フレーム数")
+parser.add_argument("--bench-out", default="bench_results.json", help="ベンチマーク結果の JSON の保存先")
+parser.add_argument("--bench-baseline", default=None, help="比較する基準の JSON")
+parser.add_argument("--bench-tolerance", type=float, default=0.15, help="p95 がこの割合を超えて遅くなったら劣化とみなす")
+parser.add_argument("--startup-report", action="store_true", help="起動の各段階にかかった時間を表示する")
+parser.add_argument("--autopilot", action="store_true", help="自機を自動操縦で動かす (ヘッドレスでも画面ありでも使える)")
+# 省略すると上の USE_* の値のまま。--bench で両方の処理を比べるときに使う
+parser.add_argument("--spatial-hash", action=argparse.BooleanOptionalAction, default=USE_SPATIAL_HASH, help="当たり判定に空間ハッシュを使う (USE_SPATIAL_HASH)")
+parser.add_argument("--swept-collision", action=argparse.BooleanOptionalAction, default=USE_SWEPT_COLLISION, help="自機の弾の当たり判定で 1 ステップ分の移動を調べる (USE_SWEPT_COLLISION)")
+parser.add_argument("--pixel-collision", action=argparse.BooleanOptionalAction, default=USE_PIXEL_COLLISION, help="自機への当たり判定を画素単位で確かめる (USE_PIXEL_COLLISION)")
+parser.add_argument("--bullet-field", action=argparse.BooleanOptionalAction, default=USE_BULLET_FIELD, help="中ボスの弾を NumPy の配列で動かす (USE_BULLET_FIELD、numpy が必要)")
+parser.add_argument("--render-hz", type=int, default=FPS, help="描画の上限フレームレート (0 は無制限、シミュレーションは常に FPS 刻み)")
+
+
+# ゲーム内の時刻 (ミリ秒)
+# 各フレームの開始時に一度だけ進め、全員が同じ値を読む
+# 実時間は使わずフレーム数から時刻を計算する (実時間との待ち合わせは Game.run で行う)
+class GameClock:
+    def __init__(self, fps):
+        self.fps = fps
+        self.reset()
+
+    # 時刻を 0 フレーム目に戻し、タイマーを全て止める
+    def reset(self):
+        self.frame = 0
+        self.time = 0
+        self.timers = {}
+
+    def tick(self):
+        self.frame += 1
+        self.time = self.frame * 1000 // self.fps
+        for event_type, timer in self.timers.items():
+            while timer[1] <= self.time:
+                pg.event.post(pg.event.Event(event_type))
+                timer[1] += timer[0]
+
+    def now(self):
+        return self.time
+
+    # pg.time.set_timer と同じ使い方で、ゲーム内の時刻に合わせてイベントを発生させる
+    def set_timer(self, event_type, millis):
+        if millis <= 0:
+            self.timers.pop(event_type, None)
+        else:
+            self.timers[event_type] = [millis, self.time + millis]
+
+
+# 乱数は用途ごとに系統を分ける (出現・敵の動き・ドロップ・背景)
+# シードを指定すると各系統が決まった列を返すので、同じ入力なら同じ展開になる
+class RandomStreams:
+    names = ("spawn", "ai", "drop", "visual")
+
+    def __init__(self, seed=None):
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        self.seed = seed
+        for name in self.names:
+            setattr(self, name, random.Random(None if seed is None else f"{seed}:{name}"))
+
+
+# ヘッドレス実行用の入力
+class KeyState:
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+# スペースを押し続けながら左右に往復する
+class SweepInput:
+    def __init__(self, period=120):
+        self.period = period
+
+    def get_pressed(self, frame):
+        direction = pg.K_LEFT if (frame // (self.period // 2)) % 2 else pg.K_RIGHT
+        return KeyState((pg.K_SPACE, direction))
+
+
+# ランダムに左右・停止を選んで数フレームずつ続ける入力 (弾はほぼ撃ち続ける)
+# ゲームの乱数とは別の系統を使うので、入力を変えても敵の出現などは変わらない
+class RandomInput:
+    moves = ((), (pg.K_LEFT,), (pg.K_RIGHT,))
+
+    def __init__(self, seed=None, hold=(10, 60), fire=0.9):
+        self.random = random.Random(None if seed is None else f"{seed}:input")
+        self.hold = hold
+        self.fire = fire
+        self.until = 0
+        self.keys = KeyState()
+
+    def get_pressed(self, frame):
+        if frame >= self.until:
+            r = self.random
+            self.until = frame + r.randint(*self.hold)
+            pressed = r.choice(self.moves)
+            if r.random() < self.fire:
+                pressed += (pg.K_SPACE,)
+            self.keys = KeyState(pressed)
+        return self.keys
+
+
+# 自動操縦 (--autopilot)
+# 画面の横幅を列に分け、敵・弾・岩が自機の高さに来るまでのフレーム数を列ごとに見積もる
+# 早く来るものほど、ダメージが大きいものほどその列を危険とし、間に合わない列は通らない
+# 安全で近い列へ動き、取れるアイテムと敵の真下を少し好む
+# 弾は撃ち続け、V で溜めておき、満タンのときに敵が真上にいれば離す
+class Autopilot:
+    column_width = 10
+    horizon = 40  # これより先に自機の高さに来るものは見ない (フレーム)
+    player_speed = 7
+    fatal_damage = 1000
+
+    def __init__(self, game):
+        self.game = game
+        self.columns = SCREEN_WIDTH // self.column_width
+        self.target = None
+        self.samples = []
+
+    def get_pressed(self, frame):
+        t0 = time.perf_counter()
+        keys = self.decide()
+        self.samples.append(time.perf_counter() - t0)
+        return keys
+
+    def decide(self):
+        player = self.game.player
+        if player.hidden:
+            return KeyState()
+        danger, arrival = self.threats(player)
+        bonus = self.bonuses(player)
+
+        cw = self.column_width
+        half = player.rect.width // 2
+        lo, hi = half // cw, (SCREEN_WIDTH - half) // cw - 1
+        here = min(max(player.rect.centerx // cw, lo), hi)
+        frames_per_column = cw / self.player_speed
+
+        # 今の列から左右へ、着く前に脅威が来てしまう列に当たるまで広げる
+        best, best_cost = here, danger[here] - bonus[here]
+        for step in (-1, 1):
+            c = here + step
+            while lo <= c <= hi:
+                if arrival[c] <= abs(c - here) * frames_per_column + 2:
+                    break
+                cost = danger[c] - bonus[c] + 0.05 * abs(c - here)
+                if cost < best_cost:
+                    best, best_cost = c, cost
+                c += step
+        # 前回の目標と同じくらい良ければ変えない (左右に揺れないように)
+        target = self.target
+        if target is not None and lo <= target <= hi and abs(target - here) <= abs(best - here):
+            if danger[target] - bonus[target] + 0.05 * abs(target - here) <= best_cost + 1:
+                best = target
+        self.target = best
+
+        pressed = [pg.K_SPACE]
+        dx = best * cw + cw // 2 - player.rect.centerx
+        if dx >= 4:
+            pressed.append(pg.K_RIGHT)
+        elif dx <= -4:
+            pressed.append(pg.K_LEFT)
+        if not (player.charge_value >= player.charge_max_time and self.aligned(player)):
+            pressed.append(pg.K_v)
+        return KeyState(pressed)
+
+    # 列ごとの危険度と、脅威が最初に自機の高さに入るフレーム数
+    def threats(self, player):
+        n = self.columns
+        danger = [0.0] * n
+        arrival = [float("inf")] * n
+        top, bottom = player.rect.top, player.rect.bottom
+        half = player.rect.width // 2
+        cw = self.column_width
+        horizon = self.horizon
+
+        def mark(left, right, y_top, y_bottom, vx, vy, damage):
+            if y_bottom >= top and y_top <= bottom:
+                t_in = 0.0
+                t_out = (bottom - y_top) / vy if vy > 0 else horizon
+            elif vy > 0 and y_bottom < top:
+                t_in = (top - y_bottom) / vy
+                t_out = (bottom - y_top) / vy
+            else:
+                return
+            if t_in > horizon:
+                return
+            t_out = min(t_out, horizon)
+            x0 = min(left + vx * t_in, left + vx * t_out) - half
+            x1 = max(right + vx * t_in, right + vx * t_out) + half
+            c0 = max(0, int(x0) // cw)
+            c1 = min(n - 1, int(x1) // cw)
+            weight = damage * (1.0 + (horizon - t_in) / horizon)
+            for c in range(c0, c1 + 1):
+                danger[c] += weight
+                if t_in < arrival[c]:
+                    arrival[c] = t_in
+
+        for bullet in enemy_bullets_group:
+            r = bullet.rect
+            mark(r.left, r.right, r.top, r.bottom, bullet.vx, bullet.vy, ENEMY_BULLET_DAMAGE)
+        for enemy in enemies_group:
+            r = enemy.rect
+            mark(r.left, r.right, r.top, r.bottom, getattr(enemy, "speed_x", 0), enemy.speed_y, ENEMY_COLLISION_DAMAGE)
+        for iwa in iwa_group:
+            r = iwa.rect
+            mark(r.left, r.right, r.top, r.bottom, 0, iwa.speed_y, IWA_DAMAGE)
+        for mid_boss in mid_boss_group:
+            r = mid_boss.rect
+            mark(r.left, r.right, r.top, r.bottom, 0, 0, self.fatal_damage)
+        field = boss_bullet_field
+        if field is not None and field.count:
+            k = field.count
+            xs, ys = field.positions(clock.frame)
+            vy = field.vy[:k]
+            near = np.flatnonzero((ys + field.r[:k] >= top - vy * horizon) & (ys - field.r[:k] <= bottom))
+            for i in near.tolist():
+                x, yy, r = float(xs[i]), float(ys[i]), float(field.r[i])
+                mark(x - r, x + r, yy - r, yy + r, float(field.vx[i]), float(field.vy[i]), ENEMY_BULLET_DAMAGE)
+        return danger, arrival
+
+    # 列ごとの好ましさ (取れそうなアイテムと、撃てる敵の真下)
+    def bonuses(self, player):
+        n = self.columns
+        bonus = [0.0] * n
+        top = player.rect.top
+        half = player.rect.width // 2
+        cw = self.column_width
+        for item in items_group:
+            r = item.rect
+            t = (top - r.bottom) / item.speed_y
+            if t < 0:
+                continue
+            # 間に合わないものは追わない
+            reach = t * self.player_speed
+            if abs(r.centerx - player.rect.centerx) > reach + half:
+                continue
+            value = 30 if isinstance(item, AttackUpItem) or player.health < player.max_health else 5
+            for c in range(max(0, (r.left - half) // cw), min(n - 1, (r.right + half) // cw) + 1):
+                bonus[c] += value
+        for enemy in enemies_group:
+            r = enemy.rect
+            if r.bottom < top - 150:
+                for c in range(max(0, r.left // cw), min(n - 1, r.right // cw) + 1):
+                    bonus[c] += 2
+        return bonus
+
+    def aligned(self, player):
+        x = player.rect.centerx
+        for group in (mid_boss_group, enemies_group):
+            for sprite in group:
+                if sprite.rect.left <= x <= sprite.rect.right and sprite.rect.bottom < player.rect.top:
+                    return True
+        return False
+
+    def report(self):
+        if not self.samples:
+            return
+        samples = sorted(self.samples)
+        n = len(samples)
+        mean = sum(samples) / n * 1e6
+        print(
+            f"Autopilot: {n} decisions, mean {mean:.1f} us, p99 {samples[min(n - 1, n * 99 // 100)] * 1e6:.1f} us,"
+            f" max {samples[-1] * 1e6:.1f} us ({mean / (10000 / FPS):.2f}% of a frame)"
+        )
+
+
 # --- ゲームの初期化 ---
-pg.init()
-pg.font.init()
-screen = pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pg.display.set_caption("Xevious Style Shooter")
-clock = pg.time.Clock()
+# import しただけでは画面も画像も作らない (Game.setup() で必要になったときに用意する)
+clock = GameClock(FPS)
+rng = RandomStreams()
+
+
+# デコード済み画像のキャッシュ
+# convert_alpha() 後の画素を画面と同じ並びのままファイルに保存し、次回からは mmap して
+# pg.image.frombuffer で包むだけにする (PNG/GIF のデコードも変換もしない)
+# 元のファイルの mtime か大きさが変わっていたらハッシュを比べ、中身が違うときだけ作り直す
+class AssetCache:
+    version = 1
+
+    def __init__(self, directory, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        self.index = None
+        self.format = None
+        self.maps = []
+        # ゲーム中に読み込んだ画像は save() まで書き出さない
+        self.pending = []
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+
+    # 画面の画素の並びに合う frombuffer の形式名 ("BGRA" など)
+    def buffer_format(self):
+        if self.format is None:
+            masks = pg.Surface((1, 1), pg.SRCALPHA).convert_alpha().get_masks()
+            for fmt in ("BGRA", "RGBA", "ARGB"):
+                try:
+                    buf = pg.image.frombuffer(bytearray(4), (1, 1), fmt)
+                except ValueError:
+                    # pygame 2.1.3 より前は "BGRA" を受け付けない
+                    continue
+                if buf.get_masks() == masks:
+                    self.format = fmt
+                    break
+        return self.format
+
+    def load_index(self):
+        if self.index is None:
+            try:
+                with open(os.path.join(self.directory, "index.json"), encoding="utf-8") as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+            # 画面の画素形式が変わったら全て作り直す
+            if self.index.get("version") != self.version or self.index.get("format") != self.buffer_format():
+                self.index = {"version": self.version, "format": self.buffer_format(), "images": {}, "listings": {}}
+                self.changed = True
+        return self.index
+
+    def load(self, path):
+        if not self.enabled or self.buffer_format() is None:
+            return pg.image.load(path).convert_alpha()
+        images = self.load_index()["images"]
+        key = os.path.relpath(path, script_dir)
+        st = os.stat(path)
+        entry = images.get(key)
+        if entry is not None and (entry["mtime"] != st.st_mtime or entry["size"] != st.st_size):
+            if entry["sha1"] == file_sha1(path):
+                entry["mtime"] = st.st_mtime
+                self.changed = True
+            else:
+                entry = None
+        if entry is not None:
+            surf = self.map(entry)
+            if surf is not None:
+                self.hits += 1
+                return surf
+        self.misses += 1
+        surf = pg.image.load(path).convert_alpha()
+        self.pending.append((key, path, st, surf))
+        self.changed = True
+        return surf
+
+    def map(self, entry):
+        w, h = entry["width"], entry["height"]
+        try:
+            with open(os.path.join(self.directory, entry["blob"]), "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+        if len(buf) != w * h * 4:
+            buf.close()
+            return None
+        # サーフェスは mmap の中身をそのまま使うので、mmap を閉じずに持っておく
+        self.maps.append(buf)
+        return pg.image.frombuffer(buf, (w, h), self.format)
+
+    def store(self, key, path, st, surf):
+        blob = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".bin"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, blob + ".tmp")
+            with open(tmp, "wb") as f:
+                # tobytes は pygame 2.1.3 から。それより前は同じ働きの tostring を使う
+                f.write(getattr(pg.image, "tobytes", pg.image.tostring)(surf, self.format))
+            os.replace(tmp, os.path.join(self.directory, blob))
+        except OSError:
+            return
+        self.index["images"][key] = {
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "sha1": file_sha1(path),
+            "width": surf.get_width(),
+            "height": surf.get_height(),
+            "blob": blob,
+        }
+        self.changed = True
+
+    # 候補のうち存在するファイル名の一覧
+    # ディレクトリの mtime が前回と同じなら (ファイルの追加・削除が無ければ) 調べ直さない
+    def existing_files(self, directory, candidates):
+        if not self.enabled:
+            return [name for name in candidates if os.path.exists(os.path.join(directory, name))]
+        listings = self.load_index()["listings"]
+        key = os.path.relpath(directory, script_dir)
+        mtime = os.path.getmtime(directory)
+        cached = listings.get(key)
+        if cached is not None and cached["mtime"] == mtime and cached["candidates"] == len(candidates):
+            return cached["names"]
+        names = [name for name in candidates if os.path.exists(os.path.join(directory, name))]
+        listings[key] = {"mtime": mtime, "candidates": len(candidates), "names": names}
+        self.changed = True
+        return names
+
+    # 読み込んだ画像の書き出しと一覧の保存
+    # 起動時 (load_assets の最後) と終了時に呼び、ゲーム中のフレームでは書き込まない
+    def save(self):
+        if not self.changed or self.index is None:
+            return
+        for key, path, st, surf in self.pending:
+            self.store(key, path, st, surf)
+        self.pending = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, "index.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.index, f, indent=1)
+            os.replace(tmp, os.path.join(self.directory, "index.json"))
+            self.changed = False
+        except OSError:
+            pass
 
 
-# 画像ファイルの読み込み
-if not os.path.exists(fig_dir):
-    os.makedirs(fig_dir)
-    print(f"Warning: '{fig_dir}' directory not found. Created an empty one.")
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+asset_cache = AssetCache(os.path.join(script_dir, ".asset_cache"), enabled=USE_ASSET_CACHE)
+
 
 # 画像読み込み用の関数
 def safe_load(path, fallback_size=(40, 40), fillcolor = (120, 120, 120)):
     try:
-        return pg.image.load(os.path.join(fig_dir, path)).convert_alpha()
+        return asset_cache.load(os.path.join(fig_dir, path))
     except Exception:
-        surf = pg.Surface(fallback_size, pg.SRCAPHA)
+        surf = pg.Surface(fallback_size, pg.SRCALPHA)
         surf.fill(fillcolor)
         return surf
-    
-PLAYER_IMAGE = safe_load("koukaton.png", (40, 40))
-ENEMY_IMAGE = safe_load("enemy.png", (40, 40))
-PLAYER_BULLET_IMAGE = safe_load("beam.png", (25, 15))
-ENEMY_BULLET_IMAGE = safe_load("beam.png", (30, 15))
-IWA_IMAGE = safe_load("iwa_01.png", (100, 100))
-LAZER_IMAGE = safe_load("lazer.png", (20, 20))
-HEAL_ITEM_IMAGE = safe_load("heal.png", (30, 30))
-ATTACK_ITEM_IMAGE = safe_load("attack.png", (30, 30))
-EXPLOSION_IMAGE_SINGLE = safe_load("explosion.gif", (60, 60))
-BOSS_IMAGE = safe_load("boss.png", (120, 100))
-MID_BOSS_IMAGE = safe_load("super_enemy.png", (120, 120))
 
+
+# BigEnemy の大きさ。体力が減るたびに次の大きさ (半分) に縮む
+BIG_ENEMY_SIZES = ((120, 100), (60, 50), (30, 25), (15, 12), (7, 6))
+
+# 画像ごとにゲーム内で使う大きさ (None は元の大きさのまま)
+# build_atlas.py はこの大きさに縮小した画像を 1 枚のアトラスに詰める
+SPRITE_SIZES = {
+    "koukaton.png": [(40, 40)],
+    "enemy.png": [(40, 40)],
+    "beam.png": [None],
+    "iwa_01.png": [(100, 100)],
+    "lazer.png": [(20, SCREEN_HEIGHT)],
+    "heal.png": [(30, 30)],
+    "attack.png": [(30, 30)],
+    "explosion.gif": [None, (60, 60), (90, 90)],
+    "boss.png": list(BIG_ENEMY_SIZES),
+    "super_enemy.png": [(120, 120)],
+}
+ATLAS_IMAGE = os.path.join(fig_dir, "atlas.png")
+ATLAS_INDEX = os.path.join(fig_dir, "atlas.json")
+
+# (ファイル名, 大きさ) -> Surface
+sprite_images = {}
+
+
+def find_explosion_frames():
+    return asset_cache.existing_files(fig_dir, [f"explosion_{i:02d}.png" for i in range(100)])
+
+
+# アトラスを読み込み、切り出した部分サーフェスを sprite_images に登録する
+# 元の画像がアトラスより新しい場合は使わない。読み込めたら爆発アニメのファイル名の一覧を返す
+def load_atlas():
+    try:
+        with open(ATLAS_INDEX, encoding="utf-8") as f:
+            index = json.load(f)
+        built = os.path.getmtime(ATLAS_IMAGE)
+        for name in index["sources"]:
+            if os.path.getmtime(os.path.join(fig_dir, name)) > built:
+                print(f"Atlas is older than {name}; run build_atlas.py again.")
+                return None
+        atlas = asset_cache.load(ATLAS_IMAGE)
+    except (OSError, ValueError, KeyError, pg.error):
+        return None
+    for name, size, rect in index["sprites"]:
+        sprite_images[(name, tuple(size) if size else None)] = atlas.subsurface(rect)
+    return index["explosion_frames"]
+
+
+# ゲーム内の大きさの画像を返す
+# アトラスに無ければ元の画像を読み込んで縮小し、以後は同じサーフェスを使い回す
+def sprite_image(name, size=None):
+    key = (name, size)
+    surf = sprite_images.get(key)
+    if surf is None:
+        original = sprite_images.get((name, None))
+        if original is None:
+            original = safe_load(name, size or (40, 40))
+            sprite_images[(name, None)] = original
+        surf = original if size is None else pg.transform.scale(original, size)
+        sprite_images[key] = surf
+    return surf
+
+
+# 画像は load_assets() が読み込むまで None
+PLAYER_IMAGE = None
+ENEMY_IMAGE = None
+PLAYER_BULLET_IMAGE = None
+ENEMY_BULLET_IMAGE = None
+IWA_IMAGE = None
+LAZER_IMAGE = None
+HEAL_ITEM_IMAGE = None
+ATTACK_ITEM_IMAGE = None
+EXPLOSION_IMAGE_SINGLE = None
+BOSS_IMAGE = None
+MID_BOSS_IMAGE = None
 EXPLOSION_FRAMES = []
-for i in range(100):
-    p = os.path.join(fig_dir, f"explosion_{i:02d}.png")
-    if os.path.exists(p):
-        try:
-            EXPLOSION_FRAMES += [pg.image.load(p).convert_alpha()]
-        except Exception:
-            pass
 
-if not EXPLOSION_FRAMES:
-    EXPLOSION_FRAMES = [EXPLOSION_IMAGE_SINGLE]
+# 弾の見た目 (元画像, サイズ, 回転角, 色)
+PLAYER_BULLET_VARIANT = None
+CHARGE_SHOT_VARIANT = None
+ENEMY_BULLET_VARIANT = None
+
+EXPLOSION_SIZES = {"normal": (60, 60), "large": (90, 90)}
+EXPLOSION_FRAME_SETS = {}
+
+
+# 画像を読み込み、弾と爆発の変形済みサーフェスを作る
+# convert_alpha() を使うので画面を作った後に呼ぶ。2 回目以降は何もしない
+def load_assets():
+    global PLAYER_IMAGE, ENEMY_IMAGE, PLAYER_BULLET_IMAGE, ENEMY_BULLET_IMAGE, IWA_IMAGE, LAZER_IMAGE
+    global HEAL_ITEM_IMAGE, ATTACK_ITEM_IMAGE, EXPLOSION_IMAGE_SINGLE, BOSS_IMAGE, MID_BOSS_IMAGE
+    global EXPLOSION_FRAMES, PLAYER_BULLET_VARIANT, CHARGE_SHOT_VARIANT, ENEMY_BULLET_VARIANT
+    if PLAYER_IMAGE is not None:
+        return
+    if not os.path.exists(fig_dir):
+        os.makedirs(fig_dir)
+        print(f"Warning: '{fig_dir}' directory not found. Created an empty one.")
+
+    frame_names = load_atlas()
+    if frame_names is None:
+        frame_names = find_explosion_frames()
+    if not frame_names:
+        frame_names = ["explosion.gif"]
+
+    PLAYER_IMAGE = sprite_image("koukaton.png", (40, 40))
+    ENEMY_IMAGE = sprite_image("enemy.png", (40, 40))
+    PLAYER_BULLET_IMAGE = sprite_image("beam.png")
+    ENEMY_BULLET_IMAGE = sprite_image("beam.png")
+    IWA_IMAGE = sprite_image("iwa_01.png", (100, 100))
+    LAZER_IMAGE = sprite_image("lazer.png", (20, SCREEN_HEIGHT))
+    HEAL_ITEM_IMAGE = sprite_image("heal.png", (30, 30))
+    ATTACK_ITEM_IMAGE = sprite_image("attack.png", (30, 30))
+    EXPLOSION_IMAGE_SINGLE = sprite_image("explosion.gif")
+    BOSS_IMAGE = sprite_image("boss.png", BIG_ENEMY_SIZES[0])
+    MID_BOSS_IMAGE = sprite_image("super_enemy.png", (120, 120))
+    EXPLOSION_FRAMES = [sprite_image(name) for name in frame_names]
+    # 縮んだ BigEnemy の画像もゲーム中に元画像を読み込まないよう先に作っておく
+    for size in BIG_ENEMY_SIZES[1:]:
+        sprite_image("boss.png", size)
+
+    PLAYER_BULLET_VARIANT = (PLAYER_BULLET_IMAGE, (25, 15), 90, None)
+    CHARGE_SHOT_VARIANT = (PLAYER_BULLET_IMAGE, (120, 60), 90, RED)
+    ENEMY_BULLET_VARIANT = (ENEMY_BULLET_IMAGE, (30, 15), -90, YELLOW)
+
+    # 起動時にまとめて作っておく
+    for variant in (PLAYER_BULLET_VARIANT, CHARGE_SHOT_VARIANT, ENEMY_BULLET_VARIANT):
+        surface_cache.get(*variant)
+
+    # 爆発アニメーションはサイズごとに一度だけ拡大縮小し、全ての Explosion で共有する
+    for size, scale in EXPLOSION_SIZES.items():
+        EXPLOSION_FRAME_SETS[size] = tuple(sprite_image(name, scale) for name in frame_names)
+    asset_cache.save()
+
+
+# 変形済みサーフェスのキャッシュ
+# (元画像, サイズ, 回転角, 色) ごとに一度だけ作り、同じサーフェスを使い回す
+class SurfaceCache:
+    def __init__(self):
+        self.surfaces = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image, size=None, angle=0, tint=None):
+        key = (image, size, angle, tint)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = image
+        if size is not None:
+            surf = pg.transform.scale(surf, size)
+        if angle:
+            surf = pg.transform.rotate(surf, angle)
+        if tint is not None:
+            if surf is image:
+                surf = image.copy()
+            color_surface = pg.Surface(surf.get_size(), pg.SRCALPHA)
+            color_surface.fill(tint)
+            surf.blit(color_surface, (0, 0), special_flags=pg.BLEND_RGBA_MULT)
+        self.surfaces[key] = surf
+        return surf
+
+    def circle(self, radius, color):
+        key = ("circle", radius, color)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            return surf
+        self.misses += 1
+        surf = pg.Surface((radius * 2, radius * 2), pg.SRCALPHA)
+        pg.draw.circle(surf, color, (radius, radius), radius)
+        self.surfaces[key] = surf
+        return surf
+
+
+surface_cache = SurfaceCache()
+
+
+# フォント (サイズ, 太字)
+# 最初に使うときに作る。SysFont(None, ...) と同じ既定のフォントだが、システムのフォント一覧は調べない
+FONT_SPECS = {
+    "score": (36, False),
+    "game_over": (64, True),
+    "boss_warning": (72, True),
+    "info": (30, False),
+    "win": (74, False),
+    "profiler": (20, False),
+}
+fonts = {}
+
+
+def get_font(name):
+    font = fonts.get(name)
+    if font is None:
+        if not pg.font.get_init():
+            pg.font.init()
+        size, bold = FONT_SPECS[name]
+        font = pg.font.Font(None, size)
+        font.set_bold(bold)
+        fonts[name] = font
+    return font
+
+# 弾のオブジェクトプール
+# kill() された弾は捨てずに回収し、次の発射で reset() して使い回す
+class SpritePool:
+    def __init__(self, sprite_class, preallocate=0, capacity=512):
+        self.sprite_class = sprite_class
+        self.capacity = capacity
+        self.free = []
+        self.created = 0
+        self.overflow = 0
+        self.peak_active = 0
+        self.preallocate = preallocate
+
+    # 起動時に preallocate 個まで確保する (画像を読み込んだ後に呼ぶ)
+    def prefill(self):
+        self.grow(self.preallocate - self.created)
+
+    def grow(self, count):
+        for _ in range(min(count, self.capacity - self.created)):
+            sprite = self.sprite_class()
+            sprite.pool = self
+            self.free.append(sprite)
+            self.created += 1
+
+    def acquire(self, *args, **kwargs):
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args, **kwargs)
+        elif self.created < self.capacity:
+            sprite = self.sprite_class(*args, **kwargs)
+            sprite.pool = self
+            self.created += 1
+        else:
+            # 上限を超えた分はプールに戻さない使い捨て
+            self.overflow += 1
+            return self.sprite_class(*args, **kwargs)
+        self.peak_active = max(self.peak_active, self.active())
+        return sprite
+
+    def release(self, sprite):
+        self.free.append(sprite)
+
+    def active(self):
+        return self.created - len(self.free)
+
+    def stats(self):
+        return {
+            "active": self.active(),
+            "free": len(self.free),
+            "created": self.created,
+            "capacity": self.capacity,
+            "peak_active": self.peak_active,
+            "overflow": self.overflow,
+        }
+
+
+class PooledSprite(pg.sprite.Sprite):
+    pool = None
+
+    def kill(self):
+        was_alive = self.alive()
+        super().kill()
+        if was_alive and self.pool is not None:
+            self.pool.release(self)
+
+
+# まっすぐ飛ぶ弾
+# 撃ったフレーム・撃った位置・1 フレームあたりの速度だけを持ち、位置は経過フレーム数から計算する
+# (途中のフレームを順に積み上げないので、どのフレームの位置にも seek() で直接飛べる)
+# 画面外に出るフレームは撃ったときに一度だけ求め、bullet_expiry の待ち行列で消す
+# サブクラスは origin を決めてから launch() を呼び、place(t) と outside() を用意する
+class ParametricBullet(PooledSprite):
+    margin = 0
+    generation = 0
+
+    def launch(self, vx, vy):
+        self.vx = vx
+        self.vy = vy
+        self.spawn_frame = clock.frame
+        # プールで使い回されても古い予約で消されないよう、撃つたびに番号を変える
+        self.generation += 1
+        self.expire_frame = self.spawn_frame + self.lifetime()
+        self.place(0)
+        bullet_expiry.push(self)
+
+    # 撃ってから画面外に出るまでのフレーム数 (速度が 0 なら消えない)
+    def lifetime(self):
+        if self.outside_at(1):
+            return 1
+        r, m = self.rect, self.margin
+        times = []
+        if self.vy > 0:
+            times.append((SCREEN_HEIGHT + m - r.top) / self.vy)
+        elif self.vy < 0:
+            times.append((-m - r.bottom) / self.vy)
+        if self.vx > 0:
+            times.append((SCREEN_WIDTH + m - r.left) / self.vx)
+        elif self.vx < 0:
+            times.append((-m - r.right) / self.vx)
+        if not times:
+            return float("inf")
+        # 連続な近似から始めて、整数の座標で判定したときの最初のフレームに合わせる
+        t = max(1, math.ceil(min(times)))
+        while t > 1 and self.outside_at(t - 1):
+            t -= 1
+        while not self.outside_at(t):
+            t += 1
+        return t
+
+    def outside_at(self, t):
+        self.place(t)
+        return self.outside()
+
+    def seek(self, frame):
+        self.place(frame - self.spawn_frame)
+
+    def update(self):
+        self.place(clock.frame - self.spawn_frame)
+
+
+# 弾の寿命の待ち行列
+# (消えるフレーム, 登録順, 弾, 撃ったときの番号) を時刻順のヒープに入れ、毎フレーム期限の来た分だけ取り出す
+# 先に当たって消えた弾や、使い回されて撃ち直された弾の古い予約は読み飛ばす
+class ExpiryQueue:
+    def __init__(self):
+        self.heap = []
+        self.counter = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, sprite):
+        if sprite.expire_frame != float("inf"):
+            heapq.heappush(self.heap, (sprite.expire_frame, self.counter, sprite, sprite.generation))
+            self.counter += 1
+
+    def expire(self):
+        frame = clock.frame
+        heap = self.heap
+        while heap and heap[0][0] <= frame:
+            _, _, sprite, generation = heapq.heappop(heap)
+            if sprite.generation == generation and sprite.alive():
+                sprite.kill()
+                self.expired += 1
+
+    def clear(self):
+        self.heap = []
 
-# フォント
-score_font = pg.font.SysFont(None, 36)
-game_over_font = pg.font.SysFont(None, 64, bold=True)
-boss_warning_font = pg.font.SysFont(None, 72, bold=True)
-info_font = pg.font.SysFont(None, 30)
 
 # --- クラス定義 ---
 class Player(pg.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pg.transform.scale(PLAYER_IMAGE, (40, 40))
+        self.image = PLAYER_IMAGE
         self.rect = self.image.get_rect(centerx=SCREEN_WIDTH // 2, bottom=SCREEN_HEIGHT - 30)
         self.speed_x = 0
         self.hidden = False
@@ -92,11 +863,12 @@ class Player(pg.sprite.Sprite):
         self.charge_max_time = 1000
         self.charge_value = 0
         self.shoot_delay = 250
-        self.last_shot = pg.time.get_ticks()
+        self.last_shot = clock.now()
         self.powerup_level = 0
         self.powerup_duration = 7000
         self.powerup_end_time = 0
         self.active_laser = None
+        self.invincible = False
 
     def update(self, keys, all_sprites, bullets_group, charge_bullets_group):
         if self.hidden:
@@ -117,7 +889,7 @@ class Player(pg.sprite.Sprite):
 
         if (
             self.powerup_level > 0
-            and pg.time.get_ticks() > self.powerup_end_time
+            and clock.now() > self.powerup_end_time
         ):
             self.powerup_level = 0
             if self.active_laser:
@@ -125,7 +897,7 @@ class Player(pg.sprite.Sprite):
                 self.active_laser = None
             print("Power-up ended.")
 
-        now = pg.time.get_ticks()
+        now = clock.now()
 
         if keys[pg.K_v]:
             if not self.is_charging:
@@ -152,18 +924,18 @@ class Player(pg.sprite.Sprite):
         if now - self.last_shot > self.shoot_delay:
             self.last_shot = now
             if self.powerup_level == 0:
-                bullet = PlayerBullet(self.rect.centerx, self.rect.top)
+                bullet = player_bullet_pool.acquire(self.rect.centerx, self.rect.top)
                 all_sprites.add(bullet)
                 bullets_group.add(bullet)
             elif self.powerup_level == 1:
-                b1 = PlayerBullet(self.rect.centerx, self.rect.top, speed_x=0)
-                b2 = PlayerBullet(self.rect.centerx, self.rect.top, speed_x=-3)
-                b3 = PlayerBullet(self.rect.centerx, self.rect.top, speed_x=3)
+                b1 = player_bullet_pool.acquire(self.rect.centerx, self.rect.top, speed_x=0)
+                b2 = player_bullet_pool.acquire(self.rect.centerx, self.rect.top, speed_x=-3)
+                b3 = player_bullet_pool.acquire(self.rect.centerx, self.rect.top, speed_x=3)
                 all_sprites.add(b1, b2, b3)
                 bullets_group.add(b1, b2, b3)
             elif self.powerup_level >= 2:
-                b2 = PlayerBullet(self.rect.centerx, self.rect.top, speed_x=-4)
-                b3 = PlayerBullet(self.rect.centerx, self.rect.top, speed_x=4)
+                b2 = player_bullet_pool.acquire(self.rect.centerx, self.rect.top, speed_x=-4)
+                b3 = player_bullet_pool.acquire(self.rect.centerx, self.rect.top, speed_x=4)
                 all_sprites.add(b2, b3)
                 bullets_group.add(b2, b3)
 
@@ -175,6 +947,8 @@ class Player(pg.sprite.Sprite):
         charge_bullets_group.add(charge_shot)
 
     def take_damage(self, amount):
+        if self.invincible:
+            return False
         self.health -= amount
         self.health = max(0, self.health)
         return self.health <= 0
@@ -184,7 +958,7 @@ class Player(pg.sprite.Sprite):
 
     def power_up(self):
         self.powerup_level = min(2, self.powerup_level + 1)
-        self.powerup_end_time = pg.time.get_ticks() + self.powerup_duration
+        self.powerup_end_time = clock.now() + self.powerup_duration
         print(f"Power-up! Level {self.powerup_level}")
 
     def hide(self):
@@ -195,20 +969,20 @@ class Player(pg.sprite.Sprite):
 class Enemy(pg.sprite.Sprite):
     def __init__(self, speed_level=0, all_sprites_ref=None, enemy_bullets_group_ref=None):
         super().__init__()
-        self.image = pg.transform.scale(ENEMY_IMAGE, (40, 40))
+        self.image = ENEMY_IMAGE
         self.rect = self.image.get_rect(
-            x=random.randrange(0, SCREEN_WIDTH - 40), y=random.randrange(-100, -40)
+            x=rng.spawn.randrange(0, SCREEN_WIDTH - 40), y=rng.spawn.randrange(-100, -40)
         )
         base_speed_min = 2
         base_speed_max = 5
         speed_increase = speed_level * 0.4
         min_speed = int(base_speed_min + speed_increase)
         max_speed = int(base_speed_max + speed_increase)
-        self.speed_y = random.randrange(min_speed, max_speed)
+        self.speed_y = rng.spawn.randrange(min_speed, max_speed)
         self.all_sprites = all_sprites_ref
         self.enemy_bullets_group = enemy_bullets_group_ref
         self.enemy_shoot_delay = 2500
-        self.last_shot = pg.time.get_ticks() - random.randrange(0, self.enemy_shoot_delay)
+        self.last_shot = clock.now() - rng.spawn.randrange(0, self.enemy_shoot_delay)
         self.health = 1
         self.score_value = 1
 
@@ -219,14 +993,18 @@ class Enemy(pg.sprite.Sprite):
         self.shoot()
 
     def shoot(self):
-        now = pg.time.get_ticks()
+        now = clock.now()
         if now - self.last_shot > self.enemy_shoot_delay:
             self.last_shot = now
-            b = EnemyBullet(self.rect.centerx, self.rect.bottom)
+            b = enemy_bullet_pool.acquire(self.rect.centerx, self.rect.bottom)
             if self.all_sprites:
                 self.all_sprites.add(b)
+            # 空のグループは偽になるので、敵弾が 1 発も無いときに撃った弾は自機に当たらない
+            # そうした弾は stray_bullets_group で動かすだけにする
             if self.enemy_bullets_group:
                 self.enemy_bullets_group.add(b)
+            else:
+                stray_bullets_group.add(b)
 
     def hit(self):
         self.health -= 1
@@ -243,18 +1021,17 @@ class BigEnemy(Enemy):
     ):
         super().__init__(speed_level, all_sprites_ref, enemy_bullets_group_ref)
         self.player = player_ref
-        self.width = 120
-        self.height = 100
-        self.image = pg.transform.scale(BOSS_IMAGE, (self.width, self.height))
-        self.rect = self.image.get_rect(x=(SCREEN_WIDTH - 120) // 2, y=-100)
-        self.scale = 1.0
+        self.image = BOSS_IMAGE
+        self.rect = self.image.get_rect(x=(SCREEN_WIDTH - self.image.get_width()) // 2, y=-100)
+        self.size_index = 0
         self.speed_y = 1
         self.speed_x = 3
         self.target_y = 100
-        self.health = 100
+        self.health = BIG_ENEMY_HEALTH
+        self.max_health = BIG_ENEMY_HEALTH
         self.score_value = 50
         self.enemy_shoot_delay = 1000
-        self.last_shot = pg.time.get_ticks()
+        self.last_shot = clock.now()
         self.last_threshold = 100
 
     def update(self):
@@ -268,44 +1045,35 @@ class BigEnemy(Enemy):
                 self.rect.x += self.speed_x
         self.shoot()
 
-        current_health = self.health
+        # 体力の割合 (%) が 20 減るごとに小さくなる
+        current_health = self.health * 100 / self.max_health
 
         if current_health <= 80 and self.last_threshold == 100:
-            self.scale *= 0.5
-            self.last_threshold = 80
-            self.image = pg.transform.scale(BOSS_IMAGE, (self.width * self.scale, self.height * self.scale))
-            self.rect = self.image.get_rect(center=self.rect.center)
-            print(call)
-
+            self.shrink(80)
         elif current_health <= 60 and self.last_threshold == 80:
-            self.scale *= 0.5
-            self.last_threshold = 60
-            self.image = pg.transform.scale(BOSS_IMAGE, (self.width * self.scale, self.height * self.scale))
-            self.rect = self.image.get_rect(center=self.rect.center)
-            print(call)
-
+            self.shrink(60)
         elif current_health <= 40 and self.last_threshold == 60:
-            self.scale *= 0.5
-            self.last_threshold = 40
-            self.image = pg.transform.scale(BOSS_IMAGE, (self.width * self.scale, self.height * self.scale))
-            self.rect = self.image.get_rect(center=self.rect.center)
-            print(call)
+            self.shrink(40)
 
         if current_health <= 20 and self.last_threshold == 40:
-            self.scale *= 0.5
-            self.last_threshold = 20
-            self.image = pg.transform.scale(BOSS_IMAGE, (self.width * self.scale, self.height * self.scale))
-            self.rect = self.image.get_rect(center=self.rect.center)
-            print(call)
+            self.shrink(20)
+
+    # BIG_ENEMY_SIZES の次の大きさに縮む (中心の位置はそのまま)
+    def shrink(self, threshold):
+        self.last_threshold = threshold
+        self.size_index += 1
+        self.image = sprite_image("boss.png", BIG_ENEMY_SIZES[self.size_index])
+        self.rect = self.image.get_rect(center=self.rect.center)
+        print(call)
 
     def shoot(self):
         if self.all_sprites is None or self.enemy_bullets_group is None:
             return
-        now = pg.time.get_ticks()
+        now = clock.now()
         if now - self.last_shot > self.enemy_shoot_delay:
             self.last_shot = now
-            b_left = EnemyBullet(self.rect.centerx - 40, self.rect.bottom, 10, self.player)
-            b_right = EnemyBullet(self.rect.centerx + 40, self.rect.bottom, 10, self.player)
+            b_left = enemy_bullet_pool.acquire(self.rect.centerx - 40, self.rect.bottom, 10, self.player)
+            b_right = enemy_bullet_pool.acquire(self.rect.centerx + 40, self.rect.bottom, 10, self.player)
             self.all_sprites.add(b_left, b_right)
             self.enemy_bullets_group.add(b_left, b_right)
 
@@ -313,16 +1081,16 @@ class BigEnemy(Enemy):
 class Iwa(pg.sprite.Sprite):
     def __init__(self, speed_level=0, all_sprites_ref=None):
         super().__init__()
-        self.image = pg.transform.scale(IWA_IMAGE, (100, 100))
+        self.image = IWA_IMAGE
         self.rect = self.image.get_rect(
-            x=random.randrange(0, SCREEN_WIDTH - 100), y=random.randrange(-100, -40)
+            x=rng.spawn.randrange(0, SCREEN_WIDTH - 100), y=rng.spawn.randrange(-100, -40)
         )
         base_speed_min = 5
         base_speed_max = 9
         speed_increase = speed_level * 0.4
         min_speed = int(base_speed_min + speed_increase)
         max_speed = int(base_speed_max + speed_increase)
-        self.speed_y = random.randrange(min_speed, max_speed) # +1を除外
+        self.speed_y = rng.spawn.randrange(min_speed, max_speed) # +1を除外
         self.all_sprites = all_sprites_ref
 
     def update(self):
@@ -331,16 +1099,22 @@ class Iwa(pg.sprite.Sprite):
             self.kill()
 
 
-class PlayerBullet(pg.sprite.Sprite):
-    def __init__(self, x, y, speed_x=0):
+class PlayerBullet(PooledSprite):
+    def __init__(self, x=0, y=0, speed_x=0):
         super().__init__()
-        raw_image = pg.transform.scale(PLAYER_BULLET_IMAGE, (25, 15))
-        self.image = pg.transform.rotate(raw_image, 90)
-        self.rect = self.image.get_rect(bottom=y, centerx=x)
+        self.image = surface_cache.get(*PLAYER_BULLET_VARIANT)
+        self.rect = self.image.get_rect()
         self.speed_y = -10
+        self.reset(x, y, speed_x)
+
+    def reset(self, x, y, speed_x=0):
+        self.rect.bottom = y
+        self.rect.centerx = x
+        self.previous = self.rect.topleft
         self.speed_x = speed_x
 
     def update(self):
+        self.previous = self.rect.topleft
         self.rect.y += self.speed_y
         self.rect.x += self.speed_x
         if self.rect.bottom < 0:
@@ -350,55 +1124,57 @@ class PlayerBullet(pg.sprite.Sprite):
 class PlayerChargeShot(pg.sprite.Sprite):
     def __init__(self, x, y):
         super().__init__()
-        raw_image = pg.transform.scale(PLAYER_BULLET_IMAGE, (120, 60))
-        self.image = pg.transform.rotate(raw_image, 90)
-        color_surface = pg.Surface(self.image.get_size(), pg.SRCALPHA)
-        color_surface.fill(RED)
-        self.image.blit(color_surface, (0, 0), special_flags=pg.BLEND_RGBA_MULT)
+        self.image = surface_cache.get(*CHARGE_SHOT_VARIANT)
         self.rect = self.image.get_rect(bottom=y, centerx=x)
+        self.previous = self.rect.topleft
         self.speed_y = -12
 
     def update(self):
+        self.previous = self.rect.topleft
         self.rect.y += self.speed_y
         if self.rect.bottom < 0:
             self.kill()
 
 
-class EnemyBullet(pg.sprite.Sprite):
-    def __init__(self, x, y, speed_y_val=7, player_ref=None):
+class EnemyBullet(ParametricBullet):
+    def __init__(self, x=0, y=0, speed_y_val=7, player_ref=None):
         super().__init__()
-        raw_image = pg.transform.scale(ENEMY_BULLET_IMAGE, (30, 15))
-        self.image = pg.transform.rotate(raw_image, -90)
-        color_surface = pg.Surface(self.image.get_size(), pg.SRCALPHA)
-        color_surface.fill(YELLOW)
-        self.image.blit(color_surface, (0, 0), special_flags=pg.BLEND_RGBA_MULT)
-        self.rect = self.image.get_rect(top=y, centerx=x)
-        self.speed_y = speed_y_val
-        self.speed_x = 0
+        self.image = surface_cache.get(*ENEMY_BULLET_VARIANT)
+        self.rect = self.image.get_rect()
+        self.reset(x, y, speed_y_val, player_ref)
+
+    def reset(self, x, y, speed_y_val=7, player_ref=None):
+        self.rect.top = y
+        self.rect.centerx = x
+        self.origin = self.rect.topleft
+        speed_x = 0
         self.player = player_ref
 
         if self.player and not self.player.hidden and self.player.rect.centery > self.rect.centery:
             dx = self.player.rect.centerx - self.rect.centerx
             dy = self.player.rect.centery - self.rect.centery
             try:
-                self.speed_x = (dx / dy) * self.speed_y
+                speed_x = (dx / dy) * speed_y_val
             except ZeroDivisionError:
-                self.speed_x = 0
-            max_speed_x = self.speed_y * 1.5
-            self.speed_x = max(-max_speed_x, min(self.speed_x, max_speed_x))
+                speed_x = 0
+            max_speed_x = speed_y_val * 1.5
+            speed_x = max(-max_speed_x, min(speed_x, max_speed_x))
+        # 整数の Rect に毎フレーム足していたときと同じ軌道になるよう、横の速度は 0.5 を切り上げて丸める
+        # (Rect は足した結果を 0 から遠い方へ丸めるので、画面内 (x >= 0) では floor(v + 0.5) ずつ進む。round() は偶数丸め)
+        self.launch(math.floor(speed_x + 0.5), speed_y_val)
 
-    def update(self):
-        self.rect.y += self.speed_y
-        self.rect.x += self.speed_x
-        if not screen.get_rect().colliderect(self.rect):
-            self.kill()
+    def place(self, t):
+        self.rect.topleft = (self.origin[0] + self.vx * t, self.origin[1] + self.vy * t)
+
+    def outside(self):
+        return not SCREEN_RECT.colliderect(self.rect)
 
 
 class SuperLaser(pg.sprite.Sprite):
     def __init__(self, player_obj):
         super().__init__()
         self.player = player_obj
-        self.image = pg.transform.scale(LAZER_IMAGE, (20, SCREEN_HEIGHT))
+        self.image = LAZER_IMAGE
         self.rect = self.image.get_rect()
         self.update()
 
@@ -421,7 +1197,7 @@ class Item(pg.sprite.Sprite):
 
 class HealItem(Item):
     def __init__(self, center):
-        self.image = pg.transform.scale(HEAL_ITEM_IMAGE, (30, 30))
+        self.image = HEAL_ITEM_IMAGE
         super().__init__(center)
 
     def apply_effect(self, player):
@@ -430,7 +1206,7 @@ class HealItem(Item):
 
 class AttackUpItem(Item):
     def __init__(self, center):
-        self.image = pg.transform.scale(ATTACK_ITEM_IMAGE, (30, 30))
+        self.image = ATTACK_ITEM_IMAGE
         super().__init__(center)
 
     def apply_effect(self, player):
@@ -438,62 +1214,60 @@ class AttackUpItem(Item):
 
 
 class Explosion(pg.sprite.Sprite):
+    frame_rate = 70
+    duration = 400
+
     def __init__(self, center, size="normal", is_anime=True):
         super().__init__()
+        if size not in EXPLOSION_SIZES:
+            size = "normal"
         self.is_anime = is_anime
-        if self.is_anime and EXPLOSION_FRAMES:
-            self.frames = list(EXPLOSION_FRAMES)
-            scale = (90, 90) if size == "large" else (60, 60)
-            self.frames = [pg.transform.scale(f, scale) for f in self.frames]
-            self.frame_rate = 70
+        if self.is_anime:
+            self.frames = EXPLOSION_FRAME_SETS[size]
             self.current_frame = 0
-            self.image = self.frames[self.current_frame]
-            self.rect = self.image.get_rect(center=center)
-            self.last_update = pg.time.get_ticks()
+            self.image = self.frames[0]
         else:
-            self.is_anime = False
-            scale = (90, 90) if size == "large" else (60, 60)
-            self.image = pg.transform.scale(EXPLOSION_IMAGE_SINGLE, scale)
-            self.rect = self.image.get_rect(center=center)
-            self.duration = 400
-            self.creation_time = pg.time.get_ticks()
+            self.image = sprite_image("explosion.gif", EXPLOSION_SIZES[size])
+        self.rect = self.image.get_rect(center=center)
+        self.start_time = clock.now()
 
     def update(self):
+        elapsed = clock.now() - self.start_time
         if self.is_anime:
-            now = pg.time.get_ticks()
-            if now - self.last_update > self.frame_rate:
-                self.last_update = now
-                self.current_frame += 1
-                if self.current_frame >= len(self.frames):
-                    self.kill()
-                else:
-                    self.image = self.frames[self.current_frame]
-        else:
-            if pg.time.get_ticks() - self.creation_time > self.duration:
+            # 経過時間から表示するフレームを決める
+            frame = elapsed // self.frame_rate
+            if frame >= len(self.frames):
                 self.kill()
+            elif frame != self.current_frame:
+                self.current_frame = frame
+                self.image = self.frames[frame]
+        elif elapsed > self.duration:
+            self.kill()
 
 
 class MidBoss(pg.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pg.transform.scale(MID_BOSS_IMAGE, (120, 120))
+        self.image = MID_BOSS_IMAGE
         self.rect = self.image.get_rect()
         self.rect.centerx = SCREEN_WIDTH // 2
         self.rect.y = -150
         self.speed_x = 3
         self.speed_y = 2
         self.direction = 1
-        self.shoot_delay = 900
-        self.last_shot = pg.time.get_ticks()
+        self.last_shot = clock.now()
+        # MID_BOSS_PATTERNS の何番目を撃っているかと、型ごとの斉射の回数
         self.shoot_pattern = 0
         self.pattern_timer = 0
-        self.spiral_angle = 0.0
+        self.volleys = dict.fromkeys(MID_BOSS_PATTERNS, 0)
         self.has_appeared = False
-        self.health = 30
-        self.max_health = 30
+        self.health = MID_BOSS_HEALTH
+        self.max_health = MID_BOSS_HEALTH
         self.score_value = 0
         self.is_special_moving = False
         self.special_moving_timer = 0
+        self.bar_image = None
+        self.bar_health = None
 
     def update(self):
         if not self.has_appeared:
@@ -506,7 +1280,7 @@ class MidBoss(pg.sprite.Sprite):
             self.special_moving_timer += 1
             if self.special_moving_timer < 60:
                 self.rect.x += self.speed_x * 3 * self.direction
-                self.rect.y += math.sin(pg.time.get_ticks() * 0.01) * 3
+                self.rect.y += math.sin(clock.now() * 0.01) * 3
             else:
                 self.is_special_moving = False
                 self.special_moving_timer = 0
@@ -516,109 +1290,843 @@ class MidBoss(pg.sprite.Sprite):
                 self.direction = -1
             elif self.rect.left <= 10:
                 self.direction = 1
-            self.rect.y += math.sin(pg.time.get_ticks() * 0.005) * 1.5
+            self.rect.y += math.sin(clock.now() * 0.005) * 1.5
 
         self.shoot()
         self.pattern_timer += 1
-        if self.pattern_timer >= 180:
-            self.shoot_pattern = (self.shoot_pattern + 1) % 2
+        if self.pattern_timer >= MID_BOSS_PATTERN_FRAMES:
+            self.shoot_pattern = (self.shoot_pattern + 1) % len(MID_BOSS_PATTERNS)
             self.pattern_timer = 0
 
-        if not self.is_special_moving and random.random() < 0.003:
+        if not self.is_special_moving and rng.ai.random() < 0.003:
             self.is_special_moving = True
             self.special_moving_timer = 0
 
     def shoot(self):
-        global all_sprites
-        global enemy_bullets_group
-        now = pg.time.get_ticks()
-        if now - self.last_shot < self.shoot_delay:
+        name = MID_BOSS_PATTERNS[self.shoot_pattern]
+        pattern = bullet_patterns[name]
+        now = clock.now()
+        if now - self.last_shot < pattern.delay:
             return
         self.last_shot = now
-        if self.shoot_pattern == 0:
-            cnt = 10
-            step = 360.0 / cnt
-            base = self.spiral_angle
-            for i in range(cnt):
-                ang = base + i * step
-                b = MidBossBullet(self.rect.centerx, self.rect.centery, ang, mode="spiral")
-                all_sprites.add(b)
-                enemy_bullets_group.add(b)
-            self.spiral_angle = (self.spiral_angle + 10) % 360
-        else:
-            spread_count = 10
-            spread_width = 100
-            center_angle = 90
-            start = center_angle - spread_width / 2
-            step = spread_width / (spread_count - 1) if spread_count > 1 else 0
-            for i in range(spread_count):
-                ang = start + i * step
-                b = MidBossBullet(self.rect.centerx, self.rect.centery + 20, ang, mode="scatter")
-                all_sprites.add(b)
-                enemy_bullets_group.add(b)
+        pattern.fire(self.rect.centerx, self.rect.centery, self.volleys[name])
+        self.volleys[name] += 1
 
     def hit(self):
         self.health -= 1
         return self.health <= 0
     
-    def draw_health_bar(self, surface):
+    def draw_health_bar(self, surface, rect=None):
+        rect = self.rect if rect is None else rect
         bw = 100
         bh = 10
-        bx = self.rect.centerx - bw // 2
-        by = self.rect.top - 20
-        pg.draw.rect(surface, RED, (bx, by, bw, bh))
-        hw = int((self.health / self.max_health) * bw)
-        pg.draw.rect(surface, YELLOW, (bx, by, hw, bh))
+        bx = rect.centerx - bw // 2
+        by = rect.top - 20
+        # 体力が変わったときだけバーを描き直す
+        if self.bar_health != self.health:
+            self.bar_health = self.health
+            self.bar_image = pg.Surface((bw, bh))
+            self.bar_image.fill(RED)
+            hw = int((self.health / self.max_health) * bw)
+            pg.draw.rect(self.bar_image, YELLOW, (0, 0, hw, bh))
+        return surface.blit(self.bar_image, (bx, by))
+
+
+# 弾幕の型
+# 起動時に斉射ごとの弾の速度を表にしておき、撃つときは表を引いて弾をまとめて出すだけにする (三角関数は使わない)
+# shape: "ring" は全方向に等間隔、"arc" は center 度 (既定は真下の 90 度) を中心に width 度の扇、"aimed" は狙う方向を 0 度とした扇
+# spin: 斉射ごとに全体を回す角度 (整数の度)。一周して元に戻るまでの斉射の数だけ表を作る
+# offset: 撃ち出す位置のずれ、delay: 斉射の間隔 (ミリ秒)
+class BulletPattern:
+    def __init__(self, name, shape="ring", count=1, speed=5.0, center=None, width=0, spin=0, offset=(0, 0), delay=900):
+        if center is None:
+            center = 0 if shape == "aimed" else 90
+        self.name = name
+        self.count = count
+        self.speed = speed
+        self.offset = offset
+        self.delay = delay
+        self.aimed = shape == "aimed"
+        if shape == "ring":
+            start, step = 0.0, 360.0 / count
+        else:
+            start = center - width / 2
+            step = width / (count - 1) if count > 1 else 0
+        self.tables = []
+        for volley in range(360 // math.gcd(360, spin)):
+            base = start + (volley * spin) % 360
+            angles = [base + i * step for i in range(count)]
+            velocities = [(math.cos(math.radians(a)) * speed, math.sin(math.radians(a)) * speed) for a in angles]
+            arrays = None
+            if np is not None:
+                rad = np.radians(np.asarray(angles, dtype=np.float32))
+                arrays = (np.cos(rad) * speed, np.sin(rad) * speed)
+            self.tables.append((velocities, arrays))
+
+    # volley は何回目の斉射か (spin の回転に使う)、target は "aimed" で狙う位置
+    def fire(self, x, y, volley=0, target=None):
+        velocities, arrays = self.tables[volley % len(self.tables)]
+        x += self.offset[0]
+        y += self.offset[1]
+        if self.aimed:
+            # 表の 0 度を狙う方向に回す (target が無ければ真下)
+            ux, uy = 0.0, 1.0
+            if target is not None:
+                dx, dy = target[0] - x, target[1] - y
+                d = math.hypot(dx, dy)
+                if d:
+                    ux, uy = dx / d, dy / d
+            velocities = [(vx * ux - vy * uy, vx * uy + vy * ux) for vx, vy in velocities]
+            if arrays is not None:
+                vx, vy = arrays
+                arrays = (vx * ux - vy * uy, vx * uy + vy * ux)
+        if boss_bullet_field is not None:
+            boss_bullet_field.spawn_many(x, y, arrays[0], arrays[1], MidBossBullet.radius)
+            return
+        acquire = mid_boss_bullet_pool.acquire
+        bullets = [acquire(x, y, vx, vy) for vx, vy in velocities]
+        all_sprites.add(*bullets)
+        enemy_bullets_group.add(*bullets)
 
 
-class MidBossBullet(pg.sprite.Sprite):
-    def __init__(self, x, y, angle_deg, mode="spriral"):
+class MidBossBullet(ParametricBullet):
+    radius = 12
+    color = (255, 50, 50)
+    margin = 60
+
+    def __init__(self, x=0, y=0, vx=0.0, vy=0.0):
         super().__init__()
-        r = 12
-        surf = pg.Surface((r * 2, r * 2), pg.SRCALPHA)
-        pg.draw.circle(surf, (255, 50, 50), (r, r), r)
-        self.image = surf
-        self.rect = self.image.get_rect(center=(int(x), int(y)))
-        self.pos_x = float(self.rect.centerx)
-        self.pos_y = float(self.rect.centery)
-        self.mode = mode
-        rad = math.radians(angle_deg)
-        dx = math.cos(rad)
-        dy = math.sin(rad)
-        if mode == "spiral":
-            speed = 5.5
-        elif mode == "scatter":
-            speed = 6.0
+        self.image = surface_cache.circle(self.radius, self.color)
+        self.rect = self.image.get_rect()
+        self.reset(x, y, vx, vy)
+
+    def reset(self, x, y, vx, vy):
+        self.rect.center = (int(x), int(y))
+        self.origin = (float(self.rect.centerx), float(self.rect.centery))
+        self.launch(vx, vy)
+
+    def place(self, t):
+        self.rect.center = (int(self.origin[0] + self.vx * t), int(self.origin[1] + self.vy * t))
+
+    def outside(self):
+        r, m = self.rect, self.margin
+        return r.top > SCREEN_HEIGHT + m or r.bottom < -m or r.left > SCREEN_WIDTH + m or r.right < -m
+
+
+# 弾幕の定義 (BulletPattern の引数)。型を増やすときはここに足して MID_BOSS_PATTERNS に並べる
+BULLET_PATTERNS = {
+    "spiral": {"shape": "ring", "count": 10, "speed": 5.5, "spin": 10},
+    "scatter": {"shape": "arc", "count": 10, "speed": 6.0, "center": 90, "width": 100, "offset": (0, 20)},
+}
+# 中ボスは MID_BOSS_PATTERN_FRAMES フレームごとに次の型へ切り替える
+MID_BOSS_PATTERNS = ("spiral", "scatter")
+MID_BOSS_PATTERN_FRAMES = 180
+bullet_patterns = {name: BulletPattern(name, **spec) for name, spec in BULLET_PATTERNS.items()}
+
+
+# 弾幕用の弾ストア
+# 撃ったフレーム・撃った位置・速度・半径を NumPy 配列で持ち、位置は必要なときに経過フレーム数から一括で計算する
+# 画面外に出るフレームは撃ったときにまとめて解いておき、いちばん早い期限が来たときだけ詰め直す
+class BulletField:
+    margin = 60
+
+    def __init__(self, image, capacity=1024):
+        self.image = image
+        self.count = 0
+        self.next_expiry = float("inf")
+        self.allocate(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def allocate(self, capacity):
+        old = self.count
+        arrays = {}
+        for name, dtype in (("x0", np.float32), ("y0", np.float32), ("vx", np.float32), ("vy", np.float32),
+                            ("r", np.float32), ("t0", np.float32), ("expire", np.float32)):
+            a = np.zeros(capacity, dtype=dtype)
+            if old:
+                a[:old] = getattr(self, name)[:old]
+            arrays[name] = a
+        alive = np.zeros(capacity, dtype=bool)
+        if old:
+            alive[:old] = self.alive[:old]
+        self.x0, self.y0 = arrays["x0"], arrays["y0"]
+        self.vx, self.vy = arrays["vx"], arrays["vy"]
+        self.r = arrays["r"]
+        self.t0, self.expire = arrays["t0"], arrays["expire"]
+        self.alive = alive
+        self.capacity = capacity
+
+    def spawn_many(self, x, y, vx, vy, r):
+        n = len(vx)
+        if self.count + n > self.capacity:
+            self.allocate(max(self.capacity * 2, self.count + n))
+        s = slice(self.count, self.count + n)
+        self.x0[s] = x
+        self.y0[s] = y
+        self.vx[s] = vx
+        self.vy[s] = vy
+        self.r[s] = r
+        self.t0[s] = clock.frame
+        self.expire[s] = clock.frame + self.lifetimes(s)
+        self.alive[s] = True
+        self.count += n
+        self.next_expiry = min(self.next_expiry, float(self.expire[s].min()))
+
+    # 撃ってから画面外 (余白 margin) に出るまでのフレーム数。軸ごとに境界を越える時刻を解き、早い方を取る
+    def lifetimes(self, s):
+        x0, y0, vx, vy, r = self.x0[s], self.y0[s], self.vx[s], self.vy[s], self.r[s]
+        m = self.margin
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ty = np.where(vy > 0, (SCREEN_HEIGHT + m + r - y0) / vy, np.where(vy < 0, (-m - r - y0) / vy, np.inf))
+            tx = np.where(vx > 0, (SCREEN_WIDTH + m + r - x0) / vx, np.where(vx < 0, (-m - r - x0) / vx, np.inf))
+        return np.maximum(np.floor(np.minimum(tx, ty)) + 1, 1)
+
+    # frame の時点の位置 (小数のフレームも可)
+    def positions(self, frame):
+        n = self.count
+        t = frame - self.t0[:n]
+        return self.x0[:n] + self.vx[:n] * t, self.y0[:n] + self.vy[:n] * t
+
+    def step(self):
+        frame = clock.frame
+        if frame < self.next_expiry:
+            return
+        n = self.count
+        self.alive[:n] &= self.expire[:n] > frame
+        self.compact()
+
+    def compact(self):
+        n = self.count
+        keep = np.flatnonzero(self.alive[:n])
+        k = len(keep)
+        if k != n:
+            for a in (self.x0, self.y0, self.vx, self.vy, self.r, self.t0, self.expire):
+                a[:k] = a[keep]
+            self.alive[:k] = True
+            self.alive[k:n] = False
+            self.count = k
+        self.next_expiry = float(self.expire[:k].min()) if k else float("inf")
+
+    # 矩形と円の当たり判定をまとめて行い、当たった弾を消して数を返す
+    def collide_rect(self, rect):
+        n = self.count
+        if not n:
+            return 0
+        x, y = self.positions(clock.frame)
+        r = self.r[:n]
+        dx = x - np.clip(x, rect.left, rect.right)
+        dy = y - np.clip(y, rect.top, rect.bottom)
+        hit = (dx * dx + dy * dy <= r * r) & self.alive[:n]
+        hits = int(np.count_nonzero(hit))
+        if hits:
+            self.alive[:n] &= ~hit
+            self.compact()
+        return hits
+
+    def clear(self):
+        self.alive[:self.count] = False
+        self.count = 0
+        self.next_expiry = float("inf")
+
+    # alpha < 1 のときは 1 ステップ前との間の時刻の位置に描く
+    def draw(self, surface, dirty=False, alpha=1.0):
+        n = self.count
+        if not n:
+            return []
+        w, h = self.image.get_size()
+        x, y = self.positions(clock.frame - 1.0 + alpha)
+        xs = (x - w / 2).astype(np.int32).tolist()
+        ys = (y - h / 2).astype(np.int32).tolist()
+        image = self.image
+        return surface.blits([(image, pos) for pos in zip(xs, ys)], doreturn=dirty) or []
+
+
+# 当たり判定の広域判定用の一様グリッド (空間ハッシュ)
+# グループごとに 1 フレーム 1 回だけセルへ登録し、近くのセルの相手だけ矩形判定する
+# column_height より背の高い矩形 (スーパーレーザーのような縦長のビーム) は、
+# x 順に並べた列から二分探索で x の範囲が重なる相手だけを取り出す
+# swept を有効にすると、groupsweep / sweepcollide は弾 (previous にステップ前の左上を持つ) が
+# 1 ステップで動いた線分と相手の矩形の交差を調べるので、速い弾が小さい的を飛び越えても当たる
+# 戻り値の形は pg.sprite.groupcollide / spritecollide と同じ
+class SpatialHash:
+    def __init__(self, cell_size=100, column_height=300, swept=True, enabled=True):
+        self.cell_size = cell_size
+        self.column_height = column_height
+        self.swept = swept
+        self.enabled = enabled
+        self.grids = {}
+        self.columns = {}
+        self.orders = {}
+        self.previous = {}
+        self.reaches = {}
+        self.swept_hits = 0
+
+    def new_frame(self):
+        self.grids = {}
+        self.columns = {}
+        self.reaches = {}
+
+    # ステップの始め (移動の前) に、弾を当てられる側のグループの位置を覚えておく
+    def snapshot(self, *groups):
+        if self.swept:
+            self.previous = {sprite: sprite.rect.topleft for group in groups for sprite in group.spritedict}
+
+    def grid_for(self, group):
+        grid = self.grids.get(group)
+        if grid is None:
+            grid = {}
+            cs = self.cell_size
+            for sprite in group:
+                r = sprite.rect
+                for cx in range(r.left // cs, (r.right - 1) // cs + 1):
+                    for cy in range(r.top // cs, (r.bottom - 1) // cs + 1):
+                        cell = grid.get((cx, cy))
+                        if cell is None:
+                            grid[(cx, cy)] = [sprite]
+                        else:
+                            cell.append(sprite)
+            self.grids[group] = grid
+        return grid
+
+    def candidates(self, rect, group):
+        grid = self.grid_for(group)
+        cs = self.cell_size
+        x0, x1 = rect.left // cs, (rect.right - 1) // cs
+        y0, y1 = rect.top // cs, (rect.bottom - 1) // cs
+        if x0 == x1 and y0 == y1:
+            return grid.get((x0, y0), ())
+        found = {}
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                for sprite in grid.get((cx, cy), ()):
+                    found[sprite] = None
+        return found
+
+    # グループを左端の x 順に並べたもの (左端の列・スプライト・いちばん広い幅)
+    # 並びはフレームをまたいで持ち越す。敵は横にはあまり動かないので、ほぼ整列済みの列を並べ直すだけで済む
+    def columns_for(self, group):
+        columns = self.columns.get(group)
+        if columns is None:
+            members = group.spritedict
+            sprites = [s for s in self.orders.get(group, ()) if s in members]
+            if len(sprites) != len(members):
+                known = set(sprites)
+                sprites += [s for s in members if s not in known]
+            sprites.sort(key=SpatialHash.left_of)
+            self.orders[group] = sprites
+            lefts = [s.rect.left for s in sprites]
+            widest = max((s.rect.width for s in sprites), default=0)
+            columns = self.columns[group] = (lefts, sprites, widest)
+        return columns
+
+    @staticmethod
+    def left_of(sprite):
+        return sprite.rect.left
+
+    # 左端が (rect.left - いちばん広い幅, rect.right) にある相手だけが x の範囲で重なりうる
+    def column_candidates(self, rect, group):
+        lefts, sprites, widest = self.columns_for(group)
+        lo = bisect.bisect_right(lefts, rect.left - widest)
+        hi = bisect.bisect_left(lefts, rect.right, lo)
+        return sprites[lo:hi]
+
+    # collided を渡すと、矩形が重なった組だけをさらに collided(sprite, other) で確かめる
+    def spritecollide(self, sprite, group, dokill, collided=None):
+        if not self.enabled:
+            if collided is not None:
+                narrow = collided
+                collided = lambda a, b: a.rect.colliderect(b.rect) and narrow(a, b)  # noqa: E731
+            return pg.sprite.spritecollide(sprite, group, dokill, collided)
+        rect = sprite.rect
+        if rect.height > self.column_height:
+            candidates = self.column_candidates(rect, group)
         else:
-            speed = 5.0
-        self.vx = dx * speed
-        self.vy = dy * speed
+            candidates = self.candidates(rect, group)
+        hits = [
+            other for other in candidates
+            if rect.colliderect(other.rect) and other in group
+        ]
+        if collided is not None:
+            hits = [other for other in hits if collided(sprite, other)]
+        if dokill:
+            for other in hits:
+                other.kill()
+        return hits
+
+    def groupcollide(self, groupa, groupb, dokilla, dokillb, collided=None):
+        if not self.enabled:
+            return pg.sprite.groupcollide(groupa, groupb, dokilla, dokillb, collided)
+        crashed = {}
+        for sprite in groupa.sprites():
+            collision = self.spritecollide(sprite, groupb, dokillb, collided)
+            if collision:
+                crashed[sprite] = collision
+                if dokilla:
+                    sprite.kill()
+        return crashed
+
+    # このステップでグループの中でいちばん大きく動いた距離 (広域判定の範囲を広げる分)
+    def reach_of(self, group):
+        reach = self.reaches.get(group)
+        if reach is None:
+            reach = 0
+            previous = self.previous
+            for sprite in group.spritedict:
+                start = previous.get(sprite)
+                if start is not None:
+                    reach = max(reach, abs(sprite.rect.x - start[0]), abs(sprite.rect.y - start[1]))
+            self.reaches[group] = reach
+        return reach
+
+    # 相手から見た弾の相対的な動きを線分として、左上がとりうる範囲 (相手の矩形を弾の大きさだけ広げたもの) と交わるか
+    # 両方がステップの間まっすぐ等速に動くなら、1 ステップでどれだけ動いても厳密
+    def swept_hit(self, sprite, other):
+        rect, target = sprite.rect, other.rect
+        px, py = sprite.previous
+        ox, oy = self.previous.get(other, target.topleft)
+        lo, hi = 0.0, 1.0
+        for start, move, low, high in (
+            (px - ox, (rect.x - px) - (target.x - ox), -rect.width, target.width),
+            (py - oy, (rect.y - py) - (target.y - oy), -rect.height, target.height),
+        ):
+            if move == 0:
+                if not low < start < high:
+                    return False
+                continue
+            t0, t1 = (low - start) / move, (high - start) / move
+            if t0 > t1:
+                t0, t1 = t1, t0
+            lo, hi = max(lo, t0), min(hi, t1)
+            if lo >= hi:
+                return False
+        return True
+
+    def sweepcollide(self, sprite, group, dokill):
+        if not self.swept:
+            return self.spritecollide(sprite, group, dokill)
+        rect = sprite.rect
+        px, py = sprite.previous
+        area = rect.union(rect.move(px - rect.x, py - rect.y))
+        reach = self.reach_of(group)
+        if reach:
+            area.inflate_ip(2 * reach, 2 * reach)
+        candidates = self.candidates(area, group) if self.enabled else group.sprites()
+        hits = [
+            other for other in candidates
+            if area.colliderect(other.rect) and other in group and self.swept_hit(sprite, other)
+        ]
+        for other in hits:
+            if not rect.colliderect(other.rect):
+                self.swept_hits += 1
+        if dokill:
+            for other in hits:
+                other.kill()
+        return hits
+
+    def groupsweep(self, groupa, groupb, dokilla, dokillb):
+        if not self.swept:
+            return self.groupcollide(groupa, groupb, dokilla, dokillb)
+        crashed = {}
+        for sprite in groupa.sprites():
+            collision = self.sweepcollide(sprite, groupb, dokillb)
+            if collision:
+                crashed[sprite] = collision
+                if dokilla:
+                    sprite.kill()
+        return crashed
+
+    def report(self):
+        if self.swept:
+            print(f"Swept collision: {self.swept_hits} hits between frames that a rect test would have missed")
+
+
+# 画素単位の当たり判定用のマスク
+# スプライトが使う画像 (surface_cache・sprite_image・アトラスの共有の面) ごとに最初に当たったときだけ作る
+# collide() は矩形の広域判定で残った組にだけ呼び、その回数をフレームごとに数える
+class MaskCache:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.masks = {}
+        self.tests = 0
+        self.hits = 0
+        self.last_tests = 0
+        self.last_hits = 0
+        self.peak_tests = 0
+        self.total_tests = 0
+        self.total_hits = 0
+        self.frames = 0
+
+    def get(self, image):
+        entry = self.masks.get(id(image))
+        if entry is None or entry[0] is not image:
+            entry = (image, pg.mask.from_surface(image))
+            self.masks[id(image)] = entry
+        return entry[1]
+
+    # pg.sprite.collide_mask と同じ使い方
+    def collide(self, a, b):
+        self.tests += 1
+        ra, rb = a.rect, b.rect
+        if self.get(a.image).overlap(self.get(b.image), (rb.x - ra.x, rb.y - ra.y)) is None:
+            return False
+        self.hits += 1
+        return True
+
+    # 当たり判定の前に呼び、前のフレームの回数を締める
+    def new_frame(self):
+        self.last_tests, self.last_hits = self.tests, self.hits
+        self.peak_tests = max(self.peak_tests, self.tests)
+        self.total_tests += self.tests
+        self.total_hits += self.hits
+        self.frames += 1
+        self.tests = self.hits = 0
+
+    def report(self):
+        if not self.enabled:
+            return
+        self.new_frame()
+        print(
+            f"Narrowphase: {self.total_tests} mask tests ({self.total_tests / max(self.frames, 1):.2f}/frame,"
+            f" peak {self.peak_tests}), {self.total_hits} hits, {len(self.masks)} masks"
+        )
 
-    def update(self):
-        self.pos_x += self.vx
-        self.pos_y += self.vy
-        self.rect.centerx = int(self.pos_x)
-        self.rect.centery = int(self.pos_y)
-        if (self.rect.top > SCREEN_HEIGHT + 60 or self.rect.bottom < -60 or self.rect.left > SCREEN_WIDTH + 60 or self.rect.right < -60):
-            self.kill()
 
+# メインループの各段階にかかった時間を記録するプロファイラ
+# 直近 size フレーム分をリングバッファに持ち、F3 でオーバーレイ表示、F4 で CSV に書き出す
+# 1 行はシミュレーションの 1 ステップ。描画の時間は、その時点で最後に進めたステップの行に足す
+# (追いつくために何ステップも進めたときはステップごとの行になり、描画が速いときは 1 行に何回分かの描画が入る)
+class FrameProfiler:
+    phases = ("events", "player", "sprites", "collision", "stars", "draw", "hud", "flip")
+
+    def __init__(self, size=600):
+        self.size = size
+        self.samples = [None] * size
+        self.index = 0
+        self.count = 0
+        self.show = False
+        self.font = None
+        self.times = [0.0] * len(self.phases)
+        self.phase_index = {name: i for i, name in enumerate(self.phases)}
+        self.last = time.perf_counter()
+        self.frame = 0
+        self.renders = 0
+        self.open = False
+
+    # ステップの始め。前のステップの行 (とそれに足した描画) をここで確定する
+    def begin_frame(self):
+        self.flush()
+        self.times = [0.0] * len(self.phases)
+        self.renders = 0
+        self.open = True
+        self.last = time.perf_counter()
+
+    def end_frame(self, frame):
+        self.frame = frame
+
+    # 描画の始め。以後の mark は最後のステップの行に足す
+    def begin_render(self):
+        if not self.open:
+            self.begin_frame()
+        self.renders += 1
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        t = time.perf_counter()
+        self.times[self.phase_index[phase]] += (t - self.last) * 1000
+        self.last = t
+
+    def flush(self):
+        if not self.open:
+            return
+        self.open = False
+        self.samples[self.index] = (self.frame, sum(self.times), *self.times, self.renders)
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    # 古い順に直近 n フレーム分を返す
+    def recent(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        start = self.index - n
+        return [self.samples[i % self.size] for i in range(start, self.index)]
+
+    def export_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "total_ms", *[f"{name}_ms" for name in self.phases], "renders"])
+            for sample in self.recent():
+                writer.writerow([sample[0], *[f"{v:.4f}" for v in sample[1:-1]], sample[-1]])
+        print(f"Frame profile written to {path}")
+
+    # counts はスプライト数などの {名前: 数}
+    def draw(self, surface, counts):
+        recent = self.recent(120)
+        if not recent:
+            return
+        if self.font is None:
+            self.font = get_font("profiler")
+        width, graph_h = 240, 60
+        rows = len(self.phases) + 1 + (len(counts) + 1) // 2
+        panel = pg.Surface((width, rows * 16 + graph_h + 16), pg.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+
+        y = 4
+        n = len(recent)
+        for i, name in enumerate(("total",) + self.phases):
+            avg = sum(sample[1 + i] for sample in recent) / n
+            panel.blit(self.font.render(name, True, WHITE), (6, y))
+            panel.blit(self.font.render(f"{avg:6.2f} ms", True, WHITE), (90, y))
+            y += 16
+
+        # フレーム時間のグラフ (上端が 33.3 ms、黄色の線が 16.6 ms)
+        top = y + 4
+        limit = 2000 / FPS
+        pg.draw.line(panel, YELLOW, (6, top + graph_h // 2), (width - 6, top + graph_h // 2))
+        points = [
+            (6 + i * (width - 12) // max(n - 1, 1), top + graph_h - int(min(sample[1], limit) / limit * graph_h))
+            for i, sample in enumerate(recent)
+        ]
+        if len(points) > 1:
+            pg.draw.lines(panel, GREEN, False, points)
+        y = top + graph_h + 6
+
+        for i, (name, count) in enumerate(counts.items()):
+            x = 6 + (i % 2) * (width // 2)
+            panel.blit(self.font.render(f"{name} {count}", True, CYAN), (x, y + (i // 2) * 16))
+        return surface.blit(panel, (SCREEN_WIDTH - width - 10, 40))
+
+
+# 固定刻みのシミュレーションの 2 つの状態の間を補間して描く
+# 各ステップの前にスプライトの位置を控えておき、描画時に alpha (0〜1) の割合で今の位置へ寄せる
+# 1 ステップで大きく動いたもの (プールから再利用された弾など) は補間せず今の位置に描く
+class RenderInterpolator:
+    snap_distance = 64
 
-def create_stars(number):
-    return [[random.randrange(0, SCREEN_WIDTH), random.randrange(0, SCREEN_HEIGHT), random.randrange(1, 4), random.randrange(1, 4)] for _ in range(number)]
+    def __init__(self):
+        self.previous = {}
+        self.alpha = 1.0
+
+    def snapshot(self, group):
+        self.previous = {sprite: sprite.rect.topleft for sprite in group.spritedict}
+
+    def position(self, sprite):
+        x, y = sprite.rect.topleft
+        previous = self.previous.get(sprite)
+        if previous is None or self.alpha >= 1.0:
+            return x, y
+        px, py = previous
+        dx, dy = x - px, y - py
+        if abs(dx) > self.snap_distance or abs(dy) > self.snap_distance:
+            return x, y
+        return round(px + dx * self.alpha), round(py + dy * self.alpha)
+
+    def rect(self, sprite):
+        rect = sprite.rect.copy()
+        rect.topleft = self.position(sprite)
+        return rect
+
+    def blits(self, group):
+        position = self.position
+        return [(sprite.image, position(sprite)) for sprite in group.sprites()]
+
+
+# 変化した部分だけを画面に送る描画 (--dirty)
+# 背景は毎フレーム全体を描き直し、前のフレームと今のフレームで描いた場所 (スプライトと星) だけを pg.display.update(rects) で送る
+# HUD は 1 枚に合成した面を毎フレーム貼るが、値が変わったときだけ画面へ送る
+# 送る範囲が広いときや矩形が多すぎるときは、細かく送るより速いので全体を flip する
+class DirtyRenderer:
+    flip_share = 0.5
+    max_rects = 1000
 
+    def __init__(self):
+        self.drawn = []
+        self.push = []
+        self.widgets = {}
+        self.seen = set()
+        self.first_frame = True
+        self.frames = 0
+        self.flips = 0
+        self.pixels = 0
+        self.screen_rect = pg.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def begin(self, surface, draw_background):
+        draw_background(surface)
+        self.push = self.drawn
+        self.drawn = []
+        self.seen = set()
+
+    def add(self, rect):
+        self.drawn.append(rect)
+        self.push.append(rect)
+
+    def add_many(self, rects):
+        self.drawn.extend(rects)
+        self.push.extend(rects)
+
+    def widget(self, name, value, rect):
+        if rect is None:
+            return
+        self.seen.add(name)
+        old = self.widgets.get(name)
+        if old is None or old[0] != value or old[1] != rect:
+            if old is not None:
+                self.push.append(old[1])
+            self.push.append(rect)
+        self.widgets[name] = (value, pg.Rect(rect))
+
+    def finish(self):
+        for name in [name for name in self.widgets if name not in self.seen]:
+            self.push.append(self.widgets.pop(name)[1])
+        full = self.screen_rect.width * self.screen_rect.height
+        pushed = full
+        if not self.first_frame and len(self.push) <= self.max_rects:
+            # 重なった矩形は二重に数えるので実際より多めになる
+            pushed = 0
+            clip = self.screen_rect.clip
+            for rect in self.push:
+                clipped = clip(rect)
+                pushed += clipped.width * clipped.height
+        self.first_frame = False
+        if pushed > full * self.flip_share:
+            pg.display.flip()
+            pushed = full
+            self.flips += 1
+        else:
+            pg.display.update(self.push)
+        self.frames += 1
+        self.pixels += pushed
+
+    def report(self):
+        full = self.screen_rect.width * self.screen_rect.height
+        avg = self.pixels / max(self.frames, 1)
+        print(
+            f"Dirty rendering: {avg:.0f} px/frame pushed on average ({avg / full:.1%} of a full flip),"
+            f" full flips {self.flips}/{self.frames}"
+        )
+
+
+# 盤面の要約ハッシュ (同じシード・同じ入力で同じ値になることの確認用)
+def state_digest(groups, *values):
+    h = hashlib.sha1(repr(values).encode())
+    for group in groups:
+        for sprite in group:
+            h.update(f"{type(sprite).__name__}{tuple(sprite.rect)}".encode())
+    return h.hexdigest()[:16]
+
+
+# 背景の星の層 (数, スクロール速度, 半径, 色)
+# 奥の層ほど小さく暗く遅い
+STAR_LAYERS = (
+    (50, 1, 1, (150, 150, 150)),
+    (35, 2, 2, (210, 210, 210)),
+    (15, 3, 3, WHITE),
+)
+
+
+# 星空の 1 層
+# 画面と同じ大きさの面に星を一度だけ描いておき、毎フレームはずらして 2 回 blit するだけにする
+class StarLayer:
+    def __init__(self, count, speed, radius, color, opaque=False):
+        self.speed = speed
+        self.radius = radius
+        self.offset = 0.0
+        self.last_step = 0.0
+        r = rng.visual
+        self.stars = [(r.randrange(0, SCREEN_WIDTH), r.randrange(0, SCREEN_HEIGHT)) for _ in range(count)]
+        surf = pg.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        surf.fill(BLACK)
+        for x, y in self.stars:
+            # 上下の端で切れないように、はみ出す分は反対側にも描く
+            for dy in (-SCREEN_HEIGHT, 0, SCREEN_HEIGHT):
+                pg.draw.circle(surf, color, (x, y + dy), radius)
+        if not opaque:
+            surf.set_colorkey(BLACK, pg.RLEACCEL)
+        self.surface = surf.convert()
+
+    # alpha は前回のスクロールからの補間の割合 (1 で最新の位置)
+    def position(self, alpha=1.0):
+        return int((self.offset - self.last_step * (1.0 - alpha)) % SCREEN_HEIGHT)
+
+    def draw(self, surface, alpha=1.0):
+        y = self.position(alpha)
+        surface.blit(self.surface, (0, y - SCREEN_HEIGHT))
+        surface.blit(self.surface, (0, y))
+
+    def scroll(self, modifier):
+        self.last_step = self.speed * modifier
+        self.offset = (self.offset + self.last_step) % SCREEN_HEIGHT
+
+    # --dirty 用: 今の位置の星を囲む矩形 (上下の端にかかる星は反対側の分も入れる)
+    def star_rects(self, alpha=1.0):
+        y = self.position(alpha)
+        r = self.radius
+        size = 2 * r + 1
+        rects = []
+        for x, sy in self.stars:
+            top = (sy + y) % SCREEN_HEIGHT - r
+            rects.append((x - r, top, size, size))
+            if top < 0:
+                rects.append((x - r, top + SCREEN_HEIGHT, size, size))
+            elif top + size > SCREEN_HEIGHT:
+                rects.append((x - r, top - SCREEN_HEIGHT, size, size))
+        return rects
+
+
+# スクロールする星空の背景
+# 一番奥の層は不透明なので、画面の塗りつぶしも兼ねる
+# 星の数に関係なく、毎フレームの負担は層ごとに blit 2 回
+class StarField:
+    def __init__(self, layers=STAR_LAYERS, density=1.0):
+        self.layers = [
+            StarLayer(max(1, int(count * density)), speed, radius, color, opaque=(i == 0))
+            for i, (count, speed, radius, color) in enumerate(layers)
+        ]
+
+    # シミュレーションの 1 ステップ分だけ流す
+    def scroll(self, speed_level=0):
+        modifier = 1.0 + speed_level * 0.15
+        for layer in self.layers:
+            layer.scroll(modifier)
+
+    def draw(self, surface, alpha=1.0):
+        for layer in self.layers:
+            layer.draw(surface, alpha)
+
+    # --dirty 用: 全ての層の星の矩形。前のフレームの分は DirtyRenderer が次のフレームで送る
+    def star_rects(self, alpha=1.0):
+        return [rect for layer in self.layers for rect in layer.star_rects(alpha)]
+
+
+# 描画済みの文字列のキャッシュ
+# (フォント, 文字列, 色) ごとに font.render の結果を持ち、上限を超えたら古いものから捨てる
+class TextCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surf = self.entries.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = font.render(text, True, color)
+        self.entries[key] = surf
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return surf
 
-def draw_stars(surface, stars, speed_level=0):
-    modifier = 1.0 + speed_level * 0.15
-    for star in stars:
-        pg.draw.circle(surface, WHITE, (star[0], star[1]), star[3])
-        star[1] += star[2] * modifier
-        if star[1] > SCREEN_HEIGHT:
-            star.clear()
-            star += [random.randrange(0, SCREEN_WIDTH), 0, random.randrange(1, 4), random.randrange(1, 4)]
+
+text_cache = TextCache()
 
 
 def draw_text(surface, text, font, color, x, y, align="topright"):
-    text_surface = font.render(text, True, color)
+    text_surface = text_cache.render(font, text, color)
     text_rect = text_surface.get_rect()
     if align == "topright":
         text_rect.topright = (x, y)
@@ -626,25 +2134,7 @@ def draw_text(surface, text, font, color, x, y, align="topright"):
         text_rect.center = (x, y)
     elif align == "topleft":
         text_rect.topleft = (x, y)
-    surface.blit(text_surface, text_rect)
-
-
-def draw_charge_gauge(surface, current_charge, max_charge, player_bottom_y):
-    if current_charge > 0:
-        gauge_width = 60
-        gauge_height = 8
-        x_pos = (SCREEN_WIDTH - gauge_width) // 2
-        y_pos = player_bottom_y + 10
-        fill_ratio = current_charge / max_charge
-        fill_width = int(fill_ratio * gauge_width)
-
-        outline_rect = pg.Rect(x_pos, y_pos, gauge_width, gauge_height)
-        fill_rect = pg.Rect(x_pos, y_pos, fill_width, gauge_height)
-        color = YELLOW if fill_ratio >= 1.0 else GREEN
-
-        pg.draw.rect(surface, GRAY, outline_rect)
-        pg.draw.rect(surface, color, fill_rect)
-        pg.draw.rect(surface, WHITE, outline_rect, 1)
+    return surface.blit(text_surface, text_rect)
 
 
 def draw_health_bar(surface, x, y, pct):
@@ -654,9 +2144,90 @@ def draw_health_bar(surface, x, y, pct):
     fill = (pct / 100) * BAR_LENGTH
     bar_color = GREEN if pct > 60 else YELLOW if pct > 30 else RED
     pg.draw.rect(surface, bar_color, (x, y, fill, BAR_HEIGHT))
-    pg.draw.rect(surface, WHITE, (x, y, BAR_LENGTH, BAR_HEIGHT), 2)
+    return pg.draw.rect(surface, WHITE, (x, y, BAR_LENGTH, BAR_HEIGHT), 2)
+
+
+# 画面上部の HUD (レベル・スコア・体力バー)
+# 1 枚の面に合成しておき、値が変わった項目だけをその場所で描き直す
+# 変化がなければ毎フレームの負担は blit 1 回
+class Hud:
+    regions = {
+        "level": pg.Rect(0, 0, SCREEN_WIDTH // 2, 36),
+        "score": pg.Rect(SCREEN_WIDTH // 2, 0, SCREEN_WIDTH // 2, 36),
+        "health": pg.Rect(0, 36, 170, 24),
+    }
+    # チャージゲージの大きさと、自機の下端からの距離
+    gauge_width = 60
+    gauge_height = 8
+    gauge_gap = 10
+
+    def __init__(self):
+        self.surface = pg.Surface((SCREEN_WIDTH, 60), pg.SRCALPHA)
+        self.rect = self.surface.get_rect()
+        self.values = {}
+        self.gauges = {}
+
+    def update(self, score, level, health):
+        changed = False
+        for name, value in (("level", level), ("score", score), ("health", max(0, health))):
+            if self.values.get(name) == value:
+                continue
+            self.values[name] = value
+            changed = True
+            self.surface.fill((0, 0, 0, 0), self.regions[name])
+            if name == "level":
+                draw_text(self.surface, f"LEVEL: {value}", get_font("score"), WHITE, 10, 10, align="topleft")
+            elif name == "score":
+                draw_text(self.surface, f"SCORE: {value}", get_font("score"), WHITE, SCREEN_WIDTH - 10, 10, align="topright")
+            else:
+                draw_health_bar(self.surface, 10, 40, value)
+        return changed
 
-stars = create_stars(100)
+    def draw(self, surface):
+        return surface.blit(self.surface, self.rect)
+
+    # チャージゲージは塗りの幅ごとに描いた面を使い回す
+    def draw_charge_gauge(self, surface, current_charge, max_charge, player_bottom_y):
+        if current_charge <= 0:
+            return None
+        width = self.gauge_width
+        fill_ratio = current_charge / max_charge
+        key = (min(int(fill_ratio * width), width), fill_ratio >= 1.0)
+        gauge = self.gauges.get(key)
+        if gauge is None:
+            gauge = pg.Surface((width, self.gauge_height))
+            gauge.fill(GRAY)
+            pg.draw.rect(gauge, YELLOW if key[1] else GREEN, (0, 0, key[0], self.gauge_height))
+            pg.draw.rect(gauge, WHITE, gauge.get_rect(), 1)
+            self.gauges[key] = gauge
+        return surface.blit(gauge, ((SCREEN_WIDTH - width) // 2, player_bottom_y + self.gauge_gap))
+
+
+# 弾のプール (起動時に確保し、足りなければ上限まで増やす)
+bullet_expiry = ExpiryQueue()
+player_bullet_pool = SpritePool(PlayerBullet, preallocate=64, capacity=512)
+enemy_bullet_pool = SpritePool(EnemyBullet, preallocate=64, capacity=512)
+mid_boss_bullet_pool = SpritePool(MidBossBullet, preallocate=128, capacity=1024)
+
+collision_grid = SpatialHash(swept=USE_SWEPT_COLLISION, enabled=USE_SPATIAL_HASH)
+mask_cache = MaskCache(enabled=USE_PIXEL_COLLISION)
+hud = Hud()
+
+# use_bullet_field() で作る
+boss_bullet_field = None
+
+
+def report_pools():
+    for name, pool in (
+        ("PlayerBullet", player_bullet_pool),
+        ("EnemyBullet", enemy_bullet_pool),
+        ("MidBossBullet", mid_boss_bullet_pool),
+    ):
+        st = pool.stats()
+        print(
+            f"{name} pool: active {st['active']}/{st['created']} (cap {st['capacity']}),"
+            f" peak {st['peak_active']}, overflow {st['overflow']}"
+        )
 
 all_sprites = pg.sprite.Group()
 enemies_group = pg.sprite.Group()
@@ -667,258 +2238,875 @@ iwa_group = pg.sprite.Group()
 items_group = pg.sprite.Group()
 laser_group = pg.sprite.Group()
 mid_boss_group = pg.sprite.Group()
+explosions_group = pg.sprite.Group()
+# 当たり判定に入らない敵弾 (Enemy.shoot を参照)
+stray_bullets_group = pg.sprite.Group()
 
-player = Player()
-all_sprites.add(player)
-
-ADD_ENEMY = pg.USEREVENT + 1
-initial_spawn_rate = 1000
-current_spawn_rate = initial_spawn_rate
-pg.time.set_timer(ADD_ENEMY, initial_spawn_rate)
-
-score = 0
-game_speed_level = 0
-game_over = False
-running = True
-level_up_message_time = 0
-
-mid_boss_spawned = False
-mid_boss_defeated = False
-mid_boss_warning_timer = 0
-mid_boss_defeat_time = 0
-MID_BOSS_SPAWN_SCORE = 5
-
-boss_spawned = False
-boss_spawn_time = 30000
-boss_warning_time = 0
-game_start_time = pg.time.get_ticks()
 
+def explode(center, size="normal", is_anime=True):
+    explosion = Explosion(center, size, is_anime)
+    all_sprites.add(explosion)
+    explosions_group.add(explosion)
+    return explosion
 
-while running:
-    clock.tick(FPS)
-    now = pg.time.get_ticks()
 
-    for event in pg.event.get():
-        if event.type == pg.QUIT:
-            running = False
-
-        elif game_over and event.type == pg.KEYDOWN:
-            running = False
-
-        elif event.type == ADD_ENEMY and not game_over:
-            if not boss_spawned:
-                new_enemy = Enemy(game_speed_level, all_sprites, enemy_bullets_group)
-                all_sprites.add(new_enemy)
-                enemies_group.add(new_enemy)
+# 種類ごとの更新処理 (システム) を決まった順に呼ぶスケジューラ
+# システムごとに対象のグループを持ち、空のグループは飛ばす。処理時間はシステムごとに積算する
+class UpdateScheduler:
+    def __init__(self):
+        self.systems = []
+        self.times = {}
+        self.calls = {}
+        self.frames = 0
+
+    # update を省略するとグループの各スプライトの update() を呼ぶ
+    # group が None のシステムは replace() で差し替えるまで動かさない
+    def add(self, name, group, update=None):
+        self.systems.append((name, group, update))
+        self.times[name] = 0.0
+        self.calls[name] = 0
+
+    # 登録済みのシステムの中身を差し替える (順番はそのまま)
+    def replace(self, name, group, update=None):
+        for i, system in enumerate(self.systems):
+            if system[0] == name:
+                self.systems[i] = (name, group, update)
+
+    def run(self, names=None):
+        self.frames += 1
+        times = self.times
+        calls = self.calls
+        t = time.perf_counter()
+        for name, group, update in self.systems:
+            if group is None or names is not None and name not in names:
+                continue
+            if update is None:
+                # Group の中身は spritedict。途中で kill() されてもよいように複製してから回す
+                sprites = group.spritedict
+                if not sprites:
+                    continue
+                for sprite in list(sprites):
+                    sprite.update()
+            elif len(group):
+                update()
+            else:
+                continue
+            now = time.perf_counter()
+            times[name] += (now - t) * 1000
+            calls[name] += 1
+            t = now
+
+    def report(self):
+        frames = max(self.frames, 1)
+        print("Update systems (ms per frame / frames active):")
+        for name, _, _ in self.systems:
+            print(f"  {name:12s} {self.times[name] / frames:7.3f} ms  {self.calls[name]}/{self.frames}")
+
+
+# 弾を撃つ側 (敵・中ボス) より先に弾を動かす。撃たれたばかりの弾はそのフレームには動かない
+scheduler = UpdateScheduler()
+scheduler.add("p_bullets", player_bullets_group)
+scheduler.add("charge", player_charge_bullets_group)
+scheduler.add("laser", laser_group)
+scheduler.add("expiry", bullet_expiry, bullet_expiry.expire)
+scheduler.add("e_bullets", enemy_bullets_group)
+scheduler.add("stray", stray_bullets_group)
+scheduler.add("enemies", enemies_group)
+scheduler.add("mid_boss", mid_boss_group)
+scheduler.add("boss_field", None)
+scheduler.add("iwa", iwa_group)
+scheduler.add("items", items_group)
+scheduler.add("explosions", explosions_group)
+
+
+# 中ボスの弾を BulletField でまとめて動かすかどうか (numpy が無ければ常にスプライトで動かす)
+def use_bullet_field(enabled):
+    global boss_bullet_field
+    if not enabled or np is None:
+        boss_bullet_field = None
+        scheduler.replace("boss_field", None)
+        return
+    if boss_bullet_field is None:
+        boss_bullet_field = BulletField(surface_cache.circle(MidBossBullet.radius, MidBossBullet.color))
+    scheduler.replace("boss_field", boss_bullet_field, boss_bullet_field.step)
+
+
+use_bullet_field(USE_BULLET_FIELD)
 
-                new_iwa = Iwa(game_speed_level, all_sprites)
-                all_sprites.add(new_iwa)
-                iwa_group.add(new_iwa)
+ADD_ENEMY = pg.USEREVENT + 1
+# 被弾の原因 (Game.damage_taken のキー)
+DAMAGE_SOURCES = ("enemy", "bullet", "iwa", "mid_boss")
+initial_spawn_rate = 1000
+MID_BOSS_SPAWN_SCORE = 5
 
-    keys = pg.key.get_pressed()
+# ゲームバランスの調整値 (batch_sim.py の --set で上書きして試せる)
+# 敵の出現間隔は速度レベルが 1 上がるごとに SPAWN_RATE_DECAY 倍になる (MIN_SPAWN_RATE ミリ秒まで)
+SPAWN_RATE_DECAY = 0.9
+MIN_SPAWN_RATE = 150
+# 自機が受けるダメージ (敵機との衝突・敵の弾・岩)
+ENEMY_COLLISION_DAMAGE = 20
+ENEMY_BULLET_DAMAGE = 10
+IWA_DAMAGE = 30
+MID_BOSS_HEALTH = 30
+BIG_ENEMY_HEALTH = 100
 
-    if not game_over:
-        player.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
 
-    if player.powerup_level >= 2 and not game_over:
-        if keys[pg.K_SPACE]:
-            if not player.active_laser:
-                player.active_laser = SuperLaser(player)
-                all_sprites.add(player.active_laser)
-                laser_group.add(player.active_laser)
+# 起動にかかった時間を段階ごとに記録する
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        t = time.perf_counter()
+        self.phases.append((name, (t - self.last) * 1000))
+        self.last = t
+
+    def report(self):
+        total = (self.last - self.start) * 1000
+        detail = ", ".join(f"{name} {ms:.1f}" for name, ms in self.phases)
+        print(f"Startup {total:.1f} ms ({detail})")
+
+
+# ゲーム本体
+# 画面・画像・盤面は setup() で用意し、run() でメインループを回す
+# ヘッドレス実行では音声とフォントを初期化せず、背景の星空も作らない
+class Game:
+    def __init__(self, args=None):
+        self.args = args if args is not None else parser.parse_args([])
+        self.headless = self.args.headless or self.args.bench is not None
+        self.startup = StartupTimer()
+        self.screen = None
+        self.starfield = None
+        self.player = None
+        self.profiler = FrameProfiler()
+        self.dirty_renderer = DirtyRenderer() if self.args.dirty else None
+        self.interpolator = RenderInterpolator()
+        self.render_clock = pg.time.Clock()
+        # キーボードの代わりに自機を動かす入力 (ヘッドレスでは左右に往復、--autopilot では自動操縦)
+        self.autopilot = Autopilot(self) if self.args.autopilot else None
+        self.scripted_input = self.autopilot or (SweepInput() if self.headless else None)
+        self.profiled_groups = {
+            "all": all_sprites,
+            "enemies": enemies_group,
+            "iwa": iwa_group,
+            "p_bullets": player_bullets_group,
+            "charge": player_charge_bullets_group,
+            "e_bullets": enemy_bullets_group,
+            "stray": stray_bullets_group,
+            "items": items_group,
+            "mid_boss": mid_boss_group,
+        }
+
+    def init_display(self):
+        if self.screen is None:
+            if self.headless:
+                os.environ["SDL_VIDEODRIVER"] = "dummy"
+                os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+                pg.display.init()
+            else:
+                pg.init()
+            self.screen = pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pg.display.set_caption("Xevious Style Shooter")
+            self.startup.mark("display")
+        return self.screen
+
+    def setup(self):
+        self.init_display()
+        load_assets()
+        self.startup.mark("assets")
+        self.apply_options()
+        rng.reseed(self.args.seed)
+        for pool in (player_bullet_pool, enemy_bullet_pool, mid_boss_bullet_pool):
+            pool.prefill()
+        self.reset()
+        self.startup.mark("world")
+
+    # 当たり判定と中ボスの弾の処理をコマンドラインの指定 (既定は USE_*) に合わせる
+    def apply_options(self):
+        args = self.args
+        collision_grid.enabled = args.spatial_hash
+        collision_grid.swept = args.swept_collision
+        collision_grid.previous = {}
+        mask_cache.enabled = args.pixel_collision
+        use_bullet_field(args.bullet_field)
+
+    # 背景の星空は最初に描くときに作る
+    def background(self):
+        if self.starfield is None:
+            self.starfield = StarField(density=self.args.star_density)
+            self.startup.mark("stars")
+        return self.starfield
+
+    def reset(self):
+        for sprite in all_sprites.sprites():
+            sprite.kill()
+        bullet_expiry.clear()
+        if boss_bullet_field is not None:
+            boss_bullet_field.clear()
+        clock.reset()
+
+        self.player = Player()
+        self.player.invincible = self.args.invincible
+        all_sprites.add(self.player)
+
+        self.current_spawn_rate = initial_spawn_rate
+        clock.set_timer(ADD_ENEMY, initial_spawn_rate)
+
+        self.score = 0
+        self.game_speed_level = 0
+        self.game_over = False
+        self.running = True
+        self.level_up_message_time = 0
+
+        self.mid_boss_spawned = False
+        self.mid_boss_defeated = False
+        self.mid_boss_warning_timer = 0
+        self.mid_boss_defeat_time = 0
+
+        self.boss_spawned = False
+        self.boss_spawn_time = 30000
+        self.boss_warning_time = 0
+        self.game_start_time = clock.now()
+
+        # バランス調整用の記録 (result() で返す)
+        self.won = False
+        self.death_cause = None
+        self.damage_taken = dict.fromkeys(DAMAGE_SOURCES, 0)
+        self.mid_boss_time = None
+        self.boss_time = None
+        # False にするとレベルが上がらず中ボスも出ない (ベンチマークで場面を固定する)
+        self.progression = True
+
+    def track(self, name, value, rect):
+        if self.dirty_renderer is not None:
+            self.dirty_renderer.widget(name, value, rect)
+
+    # 固定刻みのループ
+    # 経過した実時間をためておき、1 / FPS 秒たまるごとにシミュレーションを 1 ステップ進める
+    # 描画が遅れたときは次の描画までに何ステップか続けて進めて追いつき、余りの割合で位置を補間して描く
+    # ヘッドレスでは待たずに 1 ステップずつ進める
+    def run(self):
+        self.setup()
+        wall_start = time.perf_counter()
+        step_time = 1.0 / FPS
+        accumulator = step_time
+        last = wall_start
+        first_frame = True
+        while self.running:
+            if self.headless:
+                self.profiler.begin_frame()
+                self.step()
+                self.profiler.end_frame(clock.frame)
+            else:
+                t = time.perf_counter()
+                accumulator += min(t - last, MAX_FRAME_TIME)
+                last = t
+                steps = 0
+                while accumulator >= step_time and self.running:
+                    if steps == MAX_CATCHUP_STEPS:
+                        # 追いつけない分は捨てて、ゲームの進みを遅くする
+                        accumulator = 0.0
+                        break
+                    self.profiler.begin_frame()
+                    self.interpolator.snapshot(all_sprites)
+                    self.step()
+                    self.profiler.end_frame(clock.frame)
+                    accumulator -= step_time
+                    steps += 1
+                self.interpolator.alpha = min(accumulator / step_time, 1.0)
+                self.profiler.begin_render()
+                self.render(clock.now())
+            if first_frame:
+                first_frame = False
+                self.startup.mark("first_frame")
+                if self.args.startup_report:
+                    self.startup.report()
+            if not self.headless:
+                self.render_clock.tick(self.args.render_hz)
+        self.shutdown(time.perf_counter() - wall_start)
+
+    # シミュレーションの 1 ステップ
+    def step(self):
+        clock.tick()
+        keys = self.handle_events()
+        self.profiler.mark("events")
+        if self.starfield is not None:
+            # 星のスクロールは描画と同じ "stars" に数える
+            self.starfield.scroll(self.game_speed_level)
+            self.profiler.mark("stars")
+        self.update(keys, clock.now())
+        self.profiler.mark("collision")
+
+        if self.args.frames and clock.frame >= self.args.frames:
+            self.running = False
+
+        if self.headless and self.game_over:
+            self.running = False
+
+    def handle_events(self):
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                self.running = False
+
+            elif event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                self.profiler.show = not self.profiler.show
+
+            elif event.type == pg.KEYDOWN and event.key == pg.K_F4:
+                self.profiler.export_csv(time.strftime("profile_%Y%m%d_%H%M%S.csv"))
+
+            elif self.game_over and event.type == pg.KEYDOWN:
+                self.running = False
+
+            elif event.type == ADD_ENEMY and not self.game_over:
+                if not self.boss_spawned:
+                    new_enemy = Enemy(self.game_speed_level, all_sprites, enemy_bullets_group)
+                    all_sprites.add(new_enemy)
+                    enemies_group.add(new_enemy)
+
+                    new_iwa = Iwa(self.game_speed_level, all_sprites)
+                    all_sprites.add(new_iwa)
+                    iwa_group.add(new_iwa)
+
+        if self.scripted_input is not None:
+            return self.scripted_input.get_pressed(clock.frame)
+        return pg.key.get_pressed()
+
+    def update(self, keys, now):
+        player = self.player
+        collision_grid.snapshot(enemies_group, mid_boss_group)
+        if not self.game_over:
+            player.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
+
+        if player.powerup_level >= 2 and not self.game_over:
+            if keys[pg.K_SPACE]:
+                if not player.active_laser:
+                    player.active_laser = SuperLaser(player)
+                    all_sprites.add(player.active_laser)
+                    laser_group.add(player.active_laser)
+            else:
+                if player.active_laser:
+                    player.active_laser.kill()
+                    player.active_laser = None
         else:
             if player.active_laser:
                 player.active_laser.kill()
                 player.active_laser = None
-    else:
-        if player.active_laser:
-            player.active_laser.kill()
-            player.active_laser = None
-
-    boss_spawn_delay = 10000
-
-    if mid_boss_defeated and not boss_spawned:
-        time_since_defeat = now - mid_boss_defeat_time
-
-        if time_since_defeat > (boss_spawn_delay - 2000) and boss_warning_time == 0:
-            boss_warning_time = now
-
-    if mid_boss_defeated and not boss_spawned:
-        time_since_defeat = now - mid_boss_defeat_time
-
-        if time_since_defeat > boss_spawn_delay:
-            boss = BigEnemy(game_speed_level, all_sprites, enemy_bullets_group, player)
-            all_sprites.add(boss)
-            enemies_group.add(boss)
-            boss_spawned = True
-            boss_warning_time = 0
-            pg.time.set_timer(ADD_ENEMY, 0)
-
-    if score >= MID_BOSS_SPAWN_SCORE and not mid_boss_spawned and not mid_boss_defeated:
-        mid_boss_spawned = True
-        mid_boss_warning_timer = 180
-        mid_boss = MidBoss()
-        all_sprites.add(mid_boss)
-        mid_boss_group.add(mid_boss)
-        pg.time.set_timer(ADD_ENEMY, 0)
-
-    if mid_boss_warning_timer > 0:
-        mid_boss_warning_timer -= 1
-
-    if not game_over:
-        sprites_to_update = [s for s in all_sprites if s != player]
-        for sprite in sprites_to_update:
-            try:
-                sprite.update()
-            except TypeError:
-                try:
-                    sprite.update(keys, all_sprites, player_bullets_group, player_charge_bullets_group)
-                except Exception:
-                    pass
-    else:
-        for s in list(all_sprites):
-            if isinstance(s, Explosion):
-                s.update()
-
-    if not game_over:
-        hits_normal = pg.sprite.groupcollide(player_bullets_group, enemies_group, True, False)
-        hits_charge = pg.sprite.groupcollide(player_charge_bullets_group, enemies_group, False, False)
-        hits_laser = pg.sprite.groupcollide(laser_group, enemies_group, False, True)
+        self.profiler.mark("player")
+
+        boss_spawn_delay = 10000
+
+        if self.mid_boss_defeated and not self.boss_spawned:
+            time_since_defeat = now - self.mid_boss_defeat_time
+
+            if time_since_defeat > (boss_spawn_delay - 2000) and self.boss_warning_time == 0:
+                self.boss_warning_time = now
+
+        if self.mid_boss_defeated and not self.boss_spawned:
+            time_since_defeat = now - self.mid_boss_defeat_time
+
+            if time_since_defeat > boss_spawn_delay:
+                boss = BigEnemy(self.game_speed_level, all_sprites, enemy_bullets_group, player)
+                all_sprites.add(boss)
+                enemies_group.add(boss)
+                self.boss_spawned = True
+                self.boss_time = now - self.game_start_time
+                self.boss_warning_time = 0
+                clock.set_timer(ADD_ENEMY, 0)
+
+        if self.score >= MID_BOSS_SPAWN_SCORE and not self.mid_boss_spawned and not self.mid_boss_defeated and self.progression:
+            self.mid_boss_spawned = True
+            self.mid_boss_time = now - self.game_start_time
+            self.mid_boss_warning_timer = 180
+            mid_boss = MidBoss()
+            all_sprites.add(mid_boss)
+            mid_boss_group.add(mid_boss)
+            clock.set_timer(ADD_ENEMY, 0)
+
+        if self.mid_boss_warning_timer > 0:
+            self.mid_boss_warning_timer -= 1
+
+        if not self.game_over:
+            scheduler.run()
+        else:
+            scheduler.run(("explosions",))
+        self.profiler.mark("sprites")
+
+        if not self.game_over:
+            self.collide(now)
+
+    def collide(self, now):
+        player = self.player
+        collision_grid.new_frame()
+        mask_cache.new_frame()
+        # 自機が受ける当たりだけは画素単位で確かめる (弾・アイテムを当てる側は矩形のまま)
+        narrow = mask_cache.collide if mask_cache.enabled else None
+        hits_normal = collision_grid.groupsweep(player_bullets_group, enemies_group, True, False)
+        hits_charge = collision_grid.groupsweep(player_charge_bullets_group, enemies_group, False, False)
+        hits_laser = collision_grid.groupcollide(laser_group, enemies_group, False, True)
 
         enemies_destroyed_this_frame = 0
-        enemies_to_process = set()
+        # 処理順を毎回同じにするため set ではなく dict を使う
+        enemies_to_process = {}
 
         for bullet, enemies_hit in {**hits_normal, **hits_charge}.items():
             for e in enemies_hit:
-                enemies_to_process.add(e)
+                enemies_to_process[e] = None
 
         for laser, enemies_hit in hits_laser.items():
             for e in enemies_hit:
-                enemies_to_process.add(e)
+                enemies_to_process[e] = None
 
         for enemy_hit in enemies_to_process:
             if enemy_hit.hit():
                 size = "large" if isinstance(enemy_hit, BigEnemy) else "normal"
-                all_sprites.add(Explosion(enemy_hit.rect.center, size, is_anime=False))
-                score += enemy_hit.score_value
+                explode(enemy_hit.rect.center, size, is_anime=False)
+                self.score += enemy_hit.score_value
                 enemies_destroyed_this_frame += 1
                 enemy_hit.kill()
-                if random.random() > 0.8:
-                    item = random.choice([HealItem, AttackUpItem])(enemy_hit.rect.center)
+                if rng.drop.random() > 0.8:
+                    item = rng.drop.choice([HealItem, AttackUpItem])(enemy_hit.rect.center)
                     all_sprites.add(item)
                     items_group.add(item)
 
-        if mid_boss_spawned and not mid_boss_defeated:
-            mb_hits = pg.sprite.groupcollide(player_bullets_group, mid_boss_group, True, False)
+        if self.mid_boss_spawned and not self.mid_boss_defeated:
+            mb_hits = collision_grid.groupsweep(player_bullets_group, mid_boss_group, True, False)
             for bullet, mbs in mb_hits.items():
                 for mb in mbs:
                     if mb.hit():
-                        all_sprites.add(Explosion(mb.rect.center, "large"))
-                        score += mb.score_value
-                        mid_boss_defeated = True
+                        explode(mb.rect.center, "large")
+                        self.score += mb.score_value
+                        self.mid_boss_defeated = True
                         mb.kill()
-                        pg.time.set_timer(ADD_ENEMY, current_spawn_rate)
-                        mid_boss_defeat_time = now
+                        clock.set_timer(ADD_ENEMY, self.current_spawn_rate)
+                        self.mid_boss_defeat_time = now
 
-            mb_hits_charge = pg.sprite.groupcollide(player_charge_bullets_group, mid_boss_group, False, False)
+            mb_hits_charge = collision_grid.groupsweep(player_charge_bullets_group, mid_boss_group, False, False)
             for bullet, mbs in mb_hits_charge.items():
                 for mb in mbs:
                     if mb.hit():
-                        all_sprites.add(Explosion(mb.rect.center, "large"))
-                        score += mb.score_value
-                        mid_boss_defeated = True
+                        explode(mb.rect.center, "large")
+                        self.score += mb.score_value
+                        self.mid_boss_defeated = True
                         mb.kill()
-                        pg.time.set_timer(ADD_ENEMY, current_spawn_rate)
-                        mid_boss_defeat_time = now
-
-        if boss_spawned and not enemies_group:
-            screen.fill((0, 0, 0))
-            font = pg.font.Font(None, 74)
-            text = font.render("YOU-WIN!", True, (255, 255, 0))
+                        clock.set_timer(ADD_ENEMY, self.current_spawn_rate)
+                        self.mid_boss_defeat_time = now
+
+        if self.boss_spawned and not enemies_group:
+            self.won = True
+        if self.won and self.headless:
+            print("YOU-WIN!")
+            self.running = False
+        elif self.won:
+            self.screen.fill((0, 0, 0))
+            text = get_font("win").render("YOU-WIN!", True, (255, 255, 0))
             text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-            screen.blit(text, text_rect)
+            self.screen.blit(text, text_rect)
             pg.display.flip()
 
             pg.time.wait(3000)
-            running = False
+            self.running = False
 
-        if enemies_destroyed_this_frame > 0 and not boss_spawned:
-            new_speed_level = score // 10
-            if new_speed_level > game_speed_level:
-                game_speed_level = new_speed_level
-                level_up_message_time = pg.time.get_ticks()
-                rate = max(150, int(initial_spawn_rate * (0.9 ** game_speed_level)))
-                pg.time.set_timer(ADD_ENEMY, 0)
-                pg.time.set_timer(ADD_ENEMY, rate)
+        if enemies_destroyed_this_frame > 0 and not self.boss_spawned and self.progression:
+            new_speed_level = self.score // 10
+            if new_speed_level > self.game_speed_level:
+                self.game_speed_level = new_speed_level
+                self.level_up_message_time = clock.now()
+                rate = max(MIN_SPAWN_RATE, int(initial_spawn_rate * (SPAWN_RATE_DECAY ** self.game_speed_level)))
+                clock.set_timer(ADD_ENEMY, 0)
+                clock.set_timer(ADD_ENEMY, rate)
 
         # 被弾に関する設定
-        player_enemy_hits = pg.sprite.spritecollide(player, enemies_group, True)
+        player_enemy_hits = collision_grid.spritecollide(player, enemies_group, True, narrow)
         if player_enemy_hits:
-            if player.take_damage(20):
-                game_over = True
-                all_sprites.add(Explosion(player.rect.center, "large", is_anime=False))
-                player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal", is_anime=False))
+            self.hurt("enemy", ENEMY_COLLISION_DAMAGE)
 
-        player_beam_hits = pg.sprite.spritecollide(player, enemy_bullets_group, True)
+        player_beam_hits = collision_grid.spritecollide(player, enemy_bullets_group, True, narrow)
+        if boss_bullet_field is not None and not player.hidden:
+            if boss_bullet_field.collide_rect(player.rect):
+                player_beam_hits = True
         if player_beam_hits:
-            if player.take_damage(10):
-                game_over = True
-                all_sprites.add(Explosion(player.rect.center, "large", is_anime=False))
-                player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal", is_anime=False))
+            self.hurt("bullet", ENEMY_BULLET_DAMAGE)
 
-        player_iwa_hits = pg.sprite.spritecollide(player, iwa_group, True)
+        player_iwa_hits = collision_grid.spritecollide(player, iwa_group, True, narrow)
         if player_iwa_hits:
-            if player.take_damage(30):
-                game_over = True
-                all_sprites.add(Explosion(player.rect.center, "large", is_anime=False))
-                player.hide()
-            else:
-                all_sprites.add(Explosion(player.rect.center, "normal", is_anime=False))
+            self.hurt("iwa", IWA_DAMAGE)
 
-        for item in pg.sprite.spritecollide(player, items_group, True):
+        for item in collision_grid.spritecollide(player, items_group, True):
             item.apply_effect(player)
 
-        if mid_boss_spawned and not mid_boss_defeated:
-            player_mid_hits = pg.sprite.spritecollide(player,mid_boss_group, False)
+        if self.mid_boss_spawned and not self.mid_boss_defeated:
+            player_mid_hits = collision_grid.spritecollide(player, mid_boss_group, False, narrow)
             if player_mid_hits:
-                all_sprites.add(Explosion(player.rect.center, "large"))
-                game_over = True
-                pg.time.set_timer(ADD_ENEMY, 0)
-
-    screen.fill(BLACK)
-    draw_stars(screen, stars, game_speed_level)
-    all_sprites.draw(screen)
-
-
-    if mid_boss_spawned and not mid_boss_defeated:
-        for mb in mid_boss_group:
-            mb.draw_health_bar(screen)
-
-
-    draw_text(screen, f"SCORE: {score}", score_font, WHITE, SCREEN_WIDTH - 10, 10, align="topright")
-    draw_text(screen, f"LEVEL: {game_speed_level}", score_font, WHITE, 10, 10, align="topleft")
-    draw_health_bar(screen, 10, 40, player.health)
-
-    if not player.hidden:
-        draw_charge_gauge(screen, player.charge_value, player.charge_max_time, player.rect.bottom)
-
-    if now - level_up_message_time < 1000 and not game_over:
-        draw_text(screen, "LEVEL UP!", game_over_font, YELLOW, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, align="center")
-
-    if boss_warning_time > 0 and not game_over and (now - boss_warning_time) % 1000 < 500:
-        draw_text(screen, "!! WARNING !!", boss_warning_font, RED, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, align="center")
-
-    if game_over:
-        draw_text(screen, "GAME OVER", game_over_font, RED, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, "center")
-        draw_text(
-            screen, "Press any key to exit", info_font, WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 50, "center"
+                explode(player.rect.center, "large")
+                # 中ボスに触れると残りの体力に関係なく終わる
+                self.damage_taken["mid_boss"] += player.health
+                self.death_cause = "mid_boss"
+                self.game_over = True
+                clock.set_timer(ADD_ENEMY, 0)
+
+    # 被弾の処理。受けたダメージは原因ごとに数えておく
+    def hurt(self, source, amount):
+        player = self.player
+        before = player.health
+        dead = player.take_damage(amount)
+        self.damage_taken[source] += before - player.health
+        if dead:
+            self.death_cause = source
+            self.game_over = True
+            explode(player.rect.center, "large", is_anime=False)
+            player.hide()
+        else:
+            explode(player.rect.center, "normal", is_anime=False)
+
+    def render(self, now):
+        screen = self.screen
+        starfield = self.background()
+        track = self.track
+        interpolator = self.interpolator
+        alpha = interpolator.alpha
+        if self.dirty_renderer is not None:
+            # 背景は毎フレーム全体を描き直すので消去は不要。星は動いた分だけ送る
+            self.dirty_renderer.begin(screen, lambda surface: starfield.draw(surface, alpha))
+            self.dirty_renderer.add_many(starfield.star_rects(alpha))
+            self.profiler.mark("stars")
+            self.dirty_renderer.add_many(screen.blits(interpolator.blits(all_sprites)))
+            if boss_bullet_field is not None:
+                self.dirty_renderer.add_many(boss_bullet_field.draw(screen, dirty=True, alpha=alpha))
+        else:
+            starfield.draw(screen, alpha)
+            self.profiler.mark("stars")
+            screen.blits(interpolator.blits(all_sprites), doreturn=False)
+            if boss_bullet_field is not None:
+                boss_bullet_field.draw(screen, alpha=alpha)
+        self.profiler.mark("draw")
+
+        if self.mid_boss_spawned and not self.mid_boss_defeated:
+            for mb in mid_boss_group:
+                track("mid_boss_bar", mb.health, mb.draw_health_bar(screen, interpolator.rect(mb)))
+
+        hud.update(self.score, self.game_speed_level, self.player.health)
+        track("hud", tuple(hud.values.values()), hud.draw(screen))
+
+        if not self.player.hidden:
+            player_bottom = interpolator.rect(self.player).bottom
+            rect = hud.draw_charge_gauge(screen, self.player.charge_value, self.player.charge_max_time, player_bottom)
+            track("charge", self.player.charge_value, rect)
+
+        if now - self.level_up_message_time < 1000 and not self.game_over:
+            track("level_up", None, draw_text(screen, "LEVEL UP!", get_font("game_over"), YELLOW, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, align="center"))
+
+        if self.boss_warning_time > 0 and not self.game_over and (now - self.boss_warning_time) % 1000 < 500:
+            track("warning", None, draw_text(screen, "!! WARNING !!", get_font("boss_warning"), RED, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, align="center"))
+
+        if self.game_over:
+            track("game_over", None, draw_text(screen, "GAME OVER", get_font("game_over"), RED, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, "center"))
+            track("game_over_info", None, draw_text(
+                screen, "Press any key to exit", get_font("info"), WHITE, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 50, "center"
+            ))
+
+        if self.profiler.show:
+            counts = {name: len(group) for name, group in self.profiled_groups.items()}
+            if mask_cache.enabled:
+                counts["narrow"] = mask_cache.last_tests
+                counts["narrow hit"] = mask_cache.last_hits
+            track("profiler", clock.frame, self.profiler.draw(screen, counts))
+        self.profiler.mark("hud")
+
+        if self.dirty_renderer is not None:
+            self.dirty_renderer.finish()
+        else:
+            pg.display.flip()
+        self.profiler.mark("flip")
+
+    # 1 回のプレイの結果 (batch_sim.py が集計に使う)
+    def result(self):
+        return {
+            "frames": clock.frame,
+            "survival_ms": clock.now() - self.game_start_time,
+            "score": self.score,
+            "level": self.game_speed_level,
+            "health": self.player.health,
+            "game_over": self.game_over,
+            "won": self.won,
+            "death_cause": self.death_cause,
+            "damage": dict(self.damage_taken),
+            "mid_boss_ms": self.mid_boss_time,
+            "mid_boss_defeated": self.mid_boss_defeated,
+            "boss_ms": self.boss_time,
+        }
+
+    def shutdown(self, wall):
+        if self.headless:
+            print(
+                f"Simulated {clock.frame} frames ({clock.now() / 1000:.1f} s game time)"
+                f" in {wall:.2f} s wall: {clock.frame / max(wall, 1e-9):.0f} frames/s"
+            )
+            print(
+                f"Score {self.score}, level {self.game_speed_level}, MidBoss spawned {self.mid_boss_spawned}"
+                f" defeated {self.mid_boss_defeated}, BigEnemy spawned {self.boss_spawned}, game over {self.game_over}"
+            )
+            digest = state_digest([all_sprites], clock.frame, self.score, self.game_speed_level, self.player.health)
+            print(f"Seed {rng.seed}, state digest {digest}")
+        if self.args.profile_csv:
+            self.profiler.flush()
+            self.profiler.export_csv(self.args.profile_csv)
+        if self.dirty_renderer is not None:
+            self.dirty_renderer.report()
+        report_pools()
+        scheduler.report()
+        mask_cache.report()
+        collision_grid.report()
+        if self.autopilot is not None:
+            self.autopilot.report()
+        # ゲーム中に遅れて読み込んだ画像をここで書き出す
+        asset_cache.save()
+        pg.quit()
+
+
+# --- ベンチマーク ---
+# 既存のクラスで重い場面を再現し、Game.step と Game.render をそのまま動かして
+# FrameProfiler の区間から更新・当たり判定・描画の時間をフレームごとに測る
+def bench_reset(game, seed):
+    rng.reseed(seed)
+    game.reset()
+    clock.set_timer(ADD_ENEMY, 0)
+    game.progression = False
+    game.player.invincible = True
+
+
+def bench_spawner(level, rate=None):
+    rate = rate or max(MIN_SPAWN_RATE, int(initial_spawn_rate * (SPAWN_RATE_DECAY ** level)))
+    next_spawn = [clock.now()]
+
+    def spawn():
+        while clock.now() >= next_spawn[0]:
+            next_spawn[0] += rate
+            enemy = Enemy(level, all_sprites, enemy_bullets_group)
+            all_sprites.add(enemy)
+            enemies_group.add(enemy)
+            iwa = Iwa(level, all_sprites)
+            all_sprites.add(iwa)
+            iwa_group.add(iwa)
+    return spawn
+
+
+def scenario_waves(level, rate=None):
+    def setup(game):
+        sweep = SweepInput()
+        spawn = bench_spawner(level, rate)
+
+        def tick(frame):
+            spawn()
+            return sweep.get_pressed(frame)
+        return tick, level
+    return setup
+
+
+def scenario_mid_boss(pattern):
+    def setup(game):
+        mb = MidBoss()
+        mb.rect.y = 50
+        mb.has_appeared = True
+        mb.health = mb.max_health = 10 ** 9
+        all_sprites.add(mb)
+        mid_boss_group.add(mb)
+        game.mid_boss_spawned = True
+        sweep = SweepInput()
+
+        def tick(frame):
+            mb.shoot_pattern = pattern
+            mb.pattern_timer = 0
+            return sweep.get_pressed(frame)
+        return tick, 0
+    return setup
+
+
+def scenario_big_enemy(game):
+    boss = BigEnemy(0, all_sprites, enemy_bullets_group, game.player)
+    boss.rect.y = boss.target_y
+    boss.health = 10 ** 9
+    all_sprites.add(boss)
+    enemies_group.add(boss)
+    sweep = SweepInput()
+
+    def tick(frame):
+        return sweep.get_pressed(frame)
+    return tick, 0
+
+
+def scenario_super_laser(rate=150):
+    def setup(game):
+        player = game.player
+        player.power_up()
+        player.power_up()
+        player.powerup_end_time = float("inf")
+        player.active_laser = SuperLaser(player)
+        all_sprites.add(player.active_laser)
+        laser_group.add(player.active_laser)
+        # 画面の端から端まで往復させる
+        sweep = SweepInput(period=2 * SCREEN_WIDTH // 7)
+        spawn = bench_spawner(20, rate=rate)
+
+        def tick(frame):
+            spawn()
+            return sweep.get_pressed(frame)
+        return tick, 20
+    return setup
+
+
+def scenario_bullet_flood(per_frame=20):
+    # 1 発ずつ 1 度刻みで向きを変える型。ランダムな斉射番号を選んで 20〜160 度に撃つ
+    pattern = BulletPattern("flood", "arc", speed=5.5, center=20, spin=1)
+
+    def setup(game):
+        flood = random.Random(0)
+
+        def tick(frame):
+            for _ in range(per_frame):
+                pattern.fire(flood.randrange(0, SCREEN_WIDTH), 0, flood.randrange(141))
+            return KeyState()
+        return tick, 0
+    return setup
+
+
+BENCH_SCENARIOS = {
+    "waves_lv0": scenario_waves(0),
+    "waves_lv10": scenario_waves(10),
+    "waves_lv20": scenario_waves(20),
+    "midboss_spiral": scenario_mid_boss(0),
+    "midboss_scatter": scenario_mid_boss(1),
+    "bigenemy": scenario_big_enemy,
+    "superlaser": scenario_super_laser(),
+    "swarm": scenario_waves(20, rate=17),
+    "laser_swarm": scenario_super_laser(rate=17),
+    "bullet_flood": scenario_bullet_flood(),
+}
+
+
+# 場面の tick(frame) をヘッドレスの入力として使う
+class BenchInput:
+    def __init__(self, tick):
+        self.get_pressed = tick
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "p99": percentile(ordered, 99),
+        "mean": sum(ordered) / max(len(ordered), 1),
+    }
+
+
+def run_scenario(game, name, frames, warmup=60):
+    bench_reset(game, game.args.seed or 0)
+    tick, level = BENCH_SCENARIOS[name](game)
+    game.game_speed_level = level
+    game.scripted_input = BenchInput(tick)
+    profiler = game.profiler
+    index = profiler.phase_index
+    groups = {
+        "update": [index[phase] for phase in ("events", "player", "sprites")],
+        "collision": [index["collision"]],
+        "render": [index[phase] for phase in ("stars", "draw", "hud", "flip")],
+    }
+    phases = {"update": [], "collision": [], "render": [], "total": []}
+    narrow_start = 0
+    for frame in range(warmup + frames):
+        profiler.begin_frame()
+        game.step()
+        profiler.end_frame(clock.frame)
+        profiler.begin_render()
+        game.render(clock.now())
+        if frame == warmup:
+            narrow_start = mask_cache.total_tests
+        if frame >= warmup:
+            for phase, indices in groups.items():
+                phases[phase].append(sum(profiler.times[i] for i in indices))
+            phases["total"].append(sum(profiler.times))
+    result = {phase: summarize(values) for phase, values in phases.items()}
+    result["frames"] = frames
+    result["sprites"] = len(all_sprites)
+    result["narrow_tests"] = (mask_cache.total_tests - narrow_start) / frames
+    return result
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for phase in ("total", "update", "collision", "render"):
+            new_p95 = result[phase]["p95"]
+            old_p95 = base[phase]["p95"]
+            # 0.05 ms 未満の差は誤差として扱う
+            if new_p95 > old_p95 * (1 + tolerance) and new_p95 - old_p95 > 0.05:
+                regressions.append(f"{name} {phase}: p95 {old_p95:.2f} ms -> {new_p95:.2f} ms")
+    return regressions
+
+
+def run_benchmarks(game):
+    args = game.args
+    names = args.bench or list(BENCH_SCENARIOS)
+    unknown = [name for name in names if name not in BENCH_SCENARIOS]
+    if unknown:
+        print(f"Unknown scenario: {', '.join(unknown)} (choose from {', '.join(BENCH_SCENARIOS)})")
+        return 2
+    results = {}
+    for name in names:
+        result = run_scenario(game, name, args.bench_frames)
+        results[name] = result
+        print(
+            f"{name:16s} frame p50 {result['total']['p50']:6.2f} p95 {result['total']['p95']:6.2f}"
+            f" p99 {result['total']['p99']:6.2f} ms | p95 update {result['update']['p95']:5.2f}"
+            f" collision {result['collision']['p95']:5.2f} render {result['render']['p95']:5.2f}"
+            f" | sprites {result['sprites']} narrow {result['narrow_tests']:.2f}/frame"
         )
-
-    pg.display.flip()
-
-pg.quit()
-sys.exit()
\ No newline at end of file
+    with open(args.bench_out, "w", encoding="utf-8") as f:
+        options = {
+            "spatial_hash": collision_grid.enabled,
+            "swept_collision": collision_grid.swept,
+            "pixel_collision": mask_cache.enabled,
+            "bullet_field": boss_bullet_field is not None,
+        }
+        json.dump({"frames": args.bench_frames, "options": options, "scenarios": results}, f, indent=2)
+    print(f"Results written to {args.bench_out}")
+
+    if args.bench_baseline:
+        with open(args.bench_baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.bench_tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    game = Game(args)
+    if args.bench is not None:
+        game.setup()
+        status = run_benchmarks(game)
+        pg.quit()
+        return status
+    game.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())